@@ -0,0 +1,246 @@
+
+import argparse, gc, json, math, os, random, sys, time
+
+import run
+
+USAGE = ('\n\tpython3 bench.py [--update] [--threshold 1.25] [--time-threshold 1.5] '
+         '[--baseline bench_baseline.json]\n')
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+# An engine fails if it expands this many times more nodes than in the baseline
+DEFAULT_THRESHOLD = 1.25
+# ...or gets this many times slower on average over the mazes (geometric mean), after
+# scaling timings by the calibration run. Timings are noisier than node counts, so
+# single mazes are only reported and this is looser.
+DEFAULT_TIME_THRESHOLD = 1.5
+# Each timing is the fastest of this many measurements, taken in separate passes
+# over all the engines so that a slow spell of the machine doesn't hit all of them
+REPEATS = 5
+# A measurement calls the engine as many times as it takes to run for at least this
+# many seconds, so fast engines aren't timed at the clock's resolution
+MIN_MEASURE_TIME = 0.02
+NUM_RANDOM_MAZES = 12
+
+# Layouts of example_theory_1/2/3 as (Theseus start, Minotaur start, exit, rounds).
+# The first two use hedges from a fixed seed; the third has its own hedges in run.py.
+EXAMPLES = [
+    ('example_theory_1', (3, 2), (0, 5), (3, 3), 3),
+    ('example_theory_2', (0, 2), (5, 2), (3, 5), 8),
+    ('example_theory_3', (0, 2), (5, 2), (3, 5), 14),
+]
+
+
+def seeded_hedges(seed, num_hedges):
+    random.seed(seed)
+    run.NUM_HEDGES = num_hedges
+    return run.Hedges.set_hedges()
+
+def mazes():
+    '''
+    The fixed set of mazes to benchmark on.
+    @return: list of (name, vert hedges, hor hedges, t, m, exit, rounds) tuples
+    '''
+    cases = []
+    for i, (name, t, m, exit, rounds) in enumerate(EXAMPLES):
+        if name == 'example_theory_3':
+            vert, hor = run.EXAMPLE_3_VERT_H, run.EXAMPLE_3_HOR_H
+        else:
+            vert, hor = seeded_hedges(1000 + i, 20)
+        cases.append((name, vert, hor, t, m, exit, rounds))
+    for seed in range(NUM_RANDOM_MAZES):
+        rng = random.Random(seed)
+        vert, hor = seeded_hedges(seed, rng.randint(5, 40))
+        t, m, exit = [divmod(rng.randrange(run.BOARD_SIZE ** 2), run.BOARD_SIZE) for i in range(3)]
+        cases.append(('random_%d' % seed, vert, hor, t, m, exit, rng.randint(4, 10)))
+    return cases
+
+
+# Each engine takes one maze and returns the number of nodes it expanded.
+
+def recursive_engine(vert, hor, t, m, exit, rounds):
+    run.reset_custom_constraints()
+    run.NUM_ROUNDS = rounds
+    run.NODES_EXPANDED = 0
+    hedges = run.Hedges()
+    hedges.vert, hedges.hor = vert, hor
+    board = run.start_board(t[0], t[1], m[0], m[1], exit[0], exit[1], vert, hor)
+    run.is_winnable(board, run.ThesPos(*t), run.MinoPos(*m), run.ExitSquare(*exit), hedges, 0)
+    return run.NODES_EXPANDED
+
+def compile_engine(vert, hor, t, m, exit, rounds):
+    # Recursive search followed by compiling its theory; counts constraints, not nodes
+    recursive_engine(vert, hor, t, m, exit, rounds)
+    run.E.compile()
+    return run.encoding_size()['constraints']
+
+# Move tables for each maze, built once so the search engines time only the search
+SPACES = {}
+
+def build_space(vert, hor, exit):
+    return run.StateSpace(run.start_board(-1, -1, -1, -1, exit[0], exit[1], vert, hor),
+                          exit[0], exit[1])
+
+def state_space(vert, hor, exit):
+    key = (tuple(map(tuple, vert)), tuple(map(tuple, hor)), tuple(exit))
+    if key not in SPACES:
+        SPACES[key] = build_space(vert, hor, exit)
+    return SPACES[key]
+
+def tables_engine(vert, hor, t, m, exit, rounds):
+    # Building the StateSpace move tables; counts squares, not nodes
+    return build_space(vert, hor, exit).num_squares
+
+def search_engine(vert, hor, t, m, exit, rounds):
+    space = state_space(vert, hor, exit)
+    search = run.EscapeSearch(space)
+    search.winnable(space.square(*t), space.square(*m), rounds)
+    return search.nodes
+
+def budget_engine(vert, hor, t, m, exit, rounds):
+    space = state_space(vert, hor, exit)
+    # solve_with_budget() caches exit distances on the space; start from scratch each time
+    space.exit_dist = None
+    return run.solve_with_budget(space, space.square(*t), space.square(*m), rounds).nodes
+
+ENGINES = {
+    'recursive': recursive_engine,
+    'compile': compile_engine,
+    'search': search_engine,
+    'budget': budget_engine,
+    'tables': tables_engine,
+}
+
+
+def timed(func, *args):
+    '''
+    Times func(*args), calling it repeatedly for at least MIN_MEASURE_TIME seconds,
+    with garbage collection off (like timeit).
+    @return: (seconds per call, func's last result)
+    '''
+    calls = 0
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        while True:
+            result = func(*args)
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= MIN_MEASURE_TIME:
+                break
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return elapsed / calls, result
+
+def calibration_workload():
+    # Fixed pure-Python work that doesn't touch run.py: a breadth-first search over
+    # a grid graph, roughly the kind of work the engines do
+    size = 60
+    dist = {(0, 0): 0}
+    queue = [(0, 0)]
+    for row, col in queue:
+        for step in ((row + 1, col), (row - 1, col), (row, col + 1), (row, col - 1)):
+            if 0 <= step[0] < size and 0 <= step[1] < size and step not in dist:
+                dist[step] = dist[row, col] + 1
+                queue.append(step)
+    return len(dist)
+
+def measure():
+    '''
+    Runs every engine on every maze, plus the calibration workload.
+    @return: {'calibration': seconds, 'engines': {engine: {maze name: {'time': seconds, 'nodes': int}}}}
+    '''
+    results = {engine: {} for engine in ENGINES}
+    calibration = None
+    cases = mazes()
+    for i in range(REPEATS):
+        elapsed = timed(calibration_workload)[0]
+        calibration = elapsed if calibration is None else min(calibration, elapsed)
+        for engine, func in ENGINES.items():
+            for name, vert, hor, t, m, exit, rounds in cases:
+                elapsed, nodes = timed(func, vert, hor, t, m, exit, rounds)
+                if name in results[engine]:
+                    elapsed = min(elapsed, results[engine][name]['time'])
+                results[engine][name] = {'time': elapsed, 'nodes': nodes}
+    return {'calibration': calibration, 'engines': results}
+
+def compare(baseline, current, threshold, time_threshold):
+    '''
+    Compares node counts and timings against the baseline. Node counts are checked
+    maze by maze. Timings are first scaled by how fast the calibration workload ran
+    in each, so a faster or slower machine (or a busy one) doesn't count as a change
+    in the engines, and then checked per engine as the geometric mean of the
+    per-maze ratios, since single sub-millisecond timings are too noisy to fail on.
+    @return: (report lines, list of failure messages)
+    '''
+    scale = baseline['calibration'] / current['calibration']
+    lines = ['Calibration: baseline %.4fs, now %.4fs (timings scaled by %.2f)'
+             % (baseline['calibration'], current['calibration'], scale), '',
+             '%-10s %-18s %10s %10s %7s %10s %10s' % ('engine', 'maze', 'base s', 'now s',
+                                                      'ratio', 'base nodes', 'now nodes')]
+    failures = []
+    for engine, cases in current['engines'].items():
+        if engine not in baseline['engines']:
+            lines.append('%-10s (no baseline, skipped)' % engine)
+            continue
+        log_ratios = []
+        for name, now in cases.items():
+            base = baseline['engines'][engine].get(name)
+            if base is None:
+                lines.append('%-10s %-18s (no baseline, skipped)' % (engine, name))
+                continue
+            now_time = now['time'] * scale
+            ratio = now_time / base['time']
+            log_ratios.append(math.log(ratio))
+            flag = ''
+            if now['nodes'] > base['nodes'] * threshold:
+                flag = '  <-- nodes'
+                failures.append('%s on %s expanded %d nodes (baseline %d)'
+                                % (engine, name, now['nodes'], base['nodes']))
+            elif ratio > time_threshold:
+                flag = '  (slower)'
+            lines.append('%-10s %-18s %10.5f %10.5f %6.2fx %10d %10d%s'
+                         % (engine, name, base['time'], now_time, ratio,
+                            base['nodes'], now['nodes'], flag))
+        if log_ratios:
+            mean_ratio = math.exp(sum(log_ratios) / len(log_ratios))
+            lines.append('%-10s %-18s %21s %6.2fx' % (engine, '(mean)', '', mean_ratio))
+            if mean_ratio > time_threshold:
+                failures.append('%s is %.2fx slower on average over %d mazes (scaled)'
+                                % (engine, mean_ratio, len(log_ratios)))
+    return lines, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage=USAGE)
+    parser.add_argument('--update', action='store_true', help='overwrite the baseline with this run')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='most growth allowed in node counts')
+    parser.add_argument('--time-threshold', type=float, default=DEFAULT_TIME_THRESHOLD,
+                        help='most slowdown allowed in scaled timings')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    args = parser.parse_args()
+
+    current = measure()
+    if args.update or not os.path.isfile(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=1, sort_keys=True)
+        print("Baseline written to %s" % args.baseline)
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if 'engines' not in baseline:
+        print("%s has no calibration timing; record a new baseline with --update" % args.baseline)
+        sys.exit(1)
+    lines, failures = compare(baseline, current, args.threshold, args.time_threshold)
+    print('\n'.join(lines))
+    print()
+    if failures:
+        print("Performance regressions (thresholds %.2fx nodes, %.2fx time):"
+              % (args.threshold, args.time_threshold))
+        for failure in failures:
+            print("  " + failure)
+        sys.exit(1)
+    print("No performance regressions (thresholds %.2fx nodes, %.2fx time)."
+          % (args.threshold, args.time_threshold))
@@ -1,17 +1,78 @@
 from bauhaus import Encoding, proposition, constraint
-from nnf import config
+from functools import wraps
+from nnf import config, dimacs
+import hashlib
+import heapq
+import json
+import mmap
+import multiprocessing
+import nnf
+import os
 import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # only needed for generate_mazes() and solve_to_file()
+    np = None
 
 # SUMMARY OF FUNCTIONS/BRIEF CODE DOCUMENTATION HERE:
 # https://docs.google.com/document/d/1cW7keLwbJXumtzpbQCZ_Dcds2fXrwDSy-KxJAeD6IaA/edit
 
-config.sat_backend = "kissat"
-
 E = Encoding()
+# Maze synthesis writes its CNF by hand; its HedgeSegment propositions are kept
+# here so they never count towards E's encoding size
+SYNTHESIS = Encoding()
 
 # Constants
 BOARD_SIZE = 6
 DIRECTIONS = ['top', 'bottom', 'left', 'right']
+# How many nodes the fast search expands between checks of its cancel flag and budget
+CANCEL_CHECK_INTERVAL = 1024
+# Set to True to cache compiled theories on disk as DIMACS CNF, keyed by puzzle
+# (see theory_satisfiable()). Bump ENCODING_VERSION whenever the encoding changes
+# so that old cache entries are no longer used.
+CACHE_THEORIES = False
+CNF_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cnf_cache')
+ENCODING_VERSION = 1
+# SAT backends theory_satisfiable() can use, and the one it uses unless told
+# otherwise. 'auto' uses whichever did best in calibrate_backends().
+SAT_BACKENDS = ('kissat', 'pysat', 'native')
+SAT_BACKEND = 'kissat'
+# nnf's own solves (T.satisfiable(), T.valid(), ...) use the same backend; passing
+# backend= to the functions below only changes it for that call
+config.sat_backend = SAT_BACKEND
+# calibrate_backends() stops a solve after this many seconds and counts it as that long
+CALIBRATION_TIME_LIMIT = 5.0
+# How many layouts mine_hardest() finishes between checkpoints
+MINER_CHECKPOINT_INTERVAL = 50
+# How many cached theories calibrate_backends() times by default
+CALIBRATION_SIZE = 5
+# Maze synthesis puzzles (Theseus, Minotaur, exit, moves) to calibrate on when
+# there are no cached theories
+CALIBRATION_PUZZLES = [((0, 2), (5, 2), (3, 5), 5), ((3, 2), (0, 5), (3, 3), 3),
+                       ((5, 0), (0, 5), (2, 2), 5)]
+# Theseus' moves in the order ThesMoves.theseus_moves() tries them, as stored in
+# strategy tables, plus the codes used there for "no move" and "can't escape"
+MOVE_NAMES = ['up', 'down', 'right', 'left', 'stay']
+MOVE_OFFSETS = [(-1, 0), (1, 0), (0, 1), (0, -1), (0, 0)]
+NO_MOVE = 255
+NEVER = 0xFFFF
+# Strategy table file header: magic, format version, board size, exit square
+STRATEGY_HEADER = struct.Struct('<4sHHI')
+STRATEGY_MAGIC = b'TMST'
+# Checks of prefilter(), cheapest first
+PREFILTER_TIERS = ('immediate', 'connectivity', 'distance', 'first move')
+# Outcomes of solve_with_budget()
+WINNABLE = 'winnable'
+NOT_WINNABLE = 'not winnable'
+UNKNOWN = 'unknown'
 # Due to the recursive nature of the code, round numbers over 15
 # tend to start taking a REALLY long time, so we have limited it here
 # Even with 13-15 moves, sometimes it can take a really long time - 
@@ -29,9 +90,423 @@ NUM_HEDGES = random.randint(5, 40)
 # For example_theory_3, uncomment the line below
 #NUM_ROUNDS = 14
 
+# Structural keys of the constraints add_constraint() has passed on to E, and
+# how many repeated ones it has dropped
+CONSTRAINT_KEYS = set()
+DUPLICATE_CONSTRAINTS = 0
+
+def constraint_key(formula):
+    '''
+    Builds a hashable key describing the structure of a constraint made with the
+    &, |, ~ and >> operators, so that two separately built copies of the same
+    implication get the same key. Positions are interned (see interned()), so the
+    same square always gives the same variable.
+    @param: formula (bauhaus CustomNNF object)
+    @return: hashable key
+    '''
+    if formula.typ == 'var':
+        return formula.args[0]
+    args = tuple(constraint_key(arg) for arg in formula.args)
+    # Order doesn't matter inside a conjunction or disjunction
+    if formula.typ in ('and', 'or'):
+        return (formula.typ, frozenset(args))
+    return (formula.typ, args)
+
+def add_constraint(formula):
+    '''
+    Adds a constraint to E unless the same constraint has already been added.
+    The search revisits the same states many times, so without this the theory
+    grows with the search effort rather than with the puzzle.
+    @param: formula (bauhaus CustomNNF object)
+    '''
+    global DUPLICATE_CONSTRAINTS
+    key = constraint_key(formula)
+    if key in CONSTRAINT_KEYS:
+        DUPLICATE_CONSTRAINTS += 1
+        return
+    CONSTRAINT_KEYS.add(key)
+    E.add_constraint(formula)
+
+def reset_custom_constraints():
+    '''
+    Removes the constraints added to E by a previous search, so another puzzle
+    can be searched in the same process.
+    No args.
+    '''
+    global DUPLICATE_CONSTRAINTS
+    E._custom_constraints.clear()
+    CONSTRAINT_KEYS.clear()
+    DUPLICATE_CONSTRAINTS = 0
+
+def encoding_size(T=None):
+    '''
+    Reports how big the encoding is.
+    @param: T (NNF object or None)  compiled theory, if there is one
+    @return: dict with the number of propositions, distinct constraints and dropped
+    duplicate constraints, plus the theory's variables and size (number of operators) if T is given
+    '''
+    size = {
+        'propositions': sum(len(instances) for instances in E.propositions.values()),
+        'constraints': len(E.constraints) + len(E._custom_constraints),
+        'duplicates': DUPLICATE_CONSTRAINTS,
+    }
+    if T is not None:
+        size['variables'] = len(T.vars())
+        size['theory size'] = T.size()
+    return size
+
+def print_encoding_size(T):
+    '''
+    Prints encoding_size() for the compiled theory T.
+    '''
+    size = encoding_size(T)
+    print("Encoding: %d propositions, %d constraints (%d duplicates dropped), "
+          "%d variables, theory size %d" % (size['propositions'], size['constraints'],
+                                            size['duplicates'], size['variables'],
+                                            size['theory size']))
+
+
+def puzzle_hash(vert_h, hor_h, t_start, m_start, exit, rounds):
+    '''
+    Key identifying a puzzle (and the version of the encoding) for the theory cache.
+    @params: vert_h, hor_h (2D arrays of booleans)  hedges
+    @params: t_start, m_start, exit ((row, col) tuples)
+    @params: rounds (int)                           number of rounds
+    @return: hex string
+    '''
+    data = json.dumps([ENCODING_VERSION, BOARD_SIZE,
+                       [[bool(h) for h in row] for row in vert_h],
+                       [[bool(h) for h in row] for row in hor_h],
+                       list(t_start), list(m_start), list(exit), rounds])
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def export_dimacs(T, path, comment=None):
+    '''
+    Writes a compiled theory to a file in DIMACS CNF format. The theory is converted
+    to CNF first, which may add auxiliary variables.
+    @param: T (NNF object)          theory from E.compile()
+    @param: path (str)              file to write
+    @param: comment (str or None)   comment for the file header
+    @return: (number of variables, number of clauses) written
+    '''
+    cnf = T.to_CNF()
+    labels = {name: n for n, name in enumerate(cnf.vars(), start=1)}
+    # Write to a temporary file first so a half-written file is never picked up
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        dimacs.dump(cnf, f, mode='cnf', num_variables=len(labels), var_labels=labels,
+                    comment_header=comment)
+    os.replace(tmp_path, path)
+    return len(labels), len(cnf.children)
+
+def kissat_solver():
+    '''
+    No args.
+    @return: path to kissat (the one on the PATH, otherwise the one bundled with nnf)
+    '''
+    solver = shutil.which('kissat')
+    if solver is None:
+        solver = os.path.join(os.path.dirname(os.path.abspath(nnf.__file__)), 'bin', 'kissat')
+    return solver
+
+def dimacs_model(path):
+    '''
+    Runs kissat on a DIMACS CNF file and reads back its solution.
+    @param: path (str)  CNF file
+    @return: set of the variables (ints) that are true, or None if unsatisfiable
+    '''
+    proc = subprocess.run([kissat_solver(), '-q', path],
+                          stdout=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode == 20:
+        return None
+    if proc.returncode != 10:
+        raise RuntimeError("kissat failed with code %d on %s" % (proc.returncode, path))
+    true_vars = set()
+    for line in proc.stdout.splitlines():
+        if line.startswith('v '):
+            true_vars.update(int(lit) for lit in line.split()[1:] if int(lit) > 0)
+    return true_vars
+
+# Backend 'auto' stands for (set by calibrate_backends()), and the statistics
+# of the latest solve
+AUTO_BACKEND = None
+LAST_SOLVER_STATS = None
+
+
+class SolverStats:
+    def __init__(self, backend, satisfiable, variables, clauses, conflicts, decisions, solve_time):
+        '''
+        Telemetry from one SAT solve.
+        @param: backend (str)               backend that solved it
+        @param: satisfiable (bool)          the answer
+        @param: variables, clauses (ints)   size of the CNF handed to the solver
+        @param: conflicts, decisions (ints or None)  search statistics, from kissat and pysat.
+                                                     nnf's native solver doesn't count
+                                                     them, so they are None for it
+        @param: solve_time (float)          seconds spent in the solver
+        '''
+        self.backend = backend
+        self.satisfiable = satisfiable
+        self.variables = variables
+        self.clauses = clauses
+        self.conflicts = conflicts
+        self.decisions = decisions
+        self.solve_time = solve_time
+
+    def __repr__(self):
+        return ("SolverStats(backend=%r, satisfiable=%r, variables=%d, clauses=%d, conflicts=%r, "
+                "decisions=%r, solve_time=%.3f)" % (self.backend, self.satisfiable, self.variables,
+                                                    self.clauses, self.conflicts, self.decisions,
+                                                    self.solve_time))
+
+def print_solver_stats(stats):
+    '''
+    Prints a SolverStats object in one line.
+    '''
+    search = ''
+    if stats.conflicts is not None:
+        search = ", %d conflicts, %d decisions" % (stats.conflicts, stats.decisions)
+    print("Solver: %s, %d variables, %d clauses%s, %.3fs" % (stats.backend, stats.variables,
+                                                            stats.clauses, search, stats.solve_time))
+
+def backend_available(backend):
+    '''
+    @param: backend (str)  one of SAT_BACKENDS
+    @return: boolean (True if the backend can run here)
+    '''
+    if backend == 'kissat':
+        return os.path.isfile(kissat_solver())
+    if backend == 'pysat':
+        try:
+            import pysat
+        except ImportError:
+            return False
+        return True
+    return backend == 'native'
+
+def choose_backend(backend=None):
+    '''
+    @param: backend (str or None)  one of SAT_BACKENDS, 'auto', or None for SAT_BACKEND
+    @return: the backend to run (str)
+    '''
+    if backend is None:
+        backend = SAT_BACKEND
+    if backend == 'auto':
+        if AUTO_BACKEND is None:
+            calibrate_backends()
+        return AUTO_BACKEND
+    if backend not in SAT_BACKENDS:
+        raise ValueError("Unknown SAT backend %r (expected one of %s or 'auto')"
+                         % (backend, ', '.join(SAT_BACKENDS)))
+    if not backend_available(backend):
+        raise RuntimeError("SAT backend %r is not available" % backend)
+    return backend
+
+def kissat_stats(path):
+    '''
+    Runs kissat on a DIMACS CNF file with statistics on.
+    @param: path (str)  CNF file
+    @return: (satisfiable, conflicts, decisions)
+    '''
+    proc = subprocess.run([kissat_solver(), '-s', '-n', path],
+                          stdout=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode not in (10, 20):
+        raise RuntimeError("kissat failed with code %d on %s" % (proc.returncode, path))
+    conflicts = decisions = None
+    for line in proc.stdout.splitlines():
+        if line.startswith('c conflicts:'):
+            conflicts = int(line.split()[2])
+        elif line.startswith('c decisions:'):
+            decisions = int(line.split()[2])
+    return proc.returncode == 10, conflicts, decisions
+
+def pysat_stats(path):
+    '''
+    Solves a DIMACS CNF file with pysat, using the solver nnf is configured to use.
+    @param: path (str)  CNF file
+    @return: (satisfiable, conflicts, decisions)
+    '''
+    from pysat.formula import CNF
+    from pysat.solvers import Solver
+    with Solver(name=config.pysat_solver, bootstrap_with=CNF(from_file=path).clauses) as solver:
+        satisfiable = solver.solve()
+        stats = solver.accum_stats()
+    return satisfiable, stats.get('conflicts'), stats.get('decisions')
+
+def cnf_header(path):
+    '''
+    @param: path (str)  DIMACS CNF file
+    @return: (number of variables, number of clauses) from its header
+    '''
+    with open(path) as f:
+        for line in f:
+            if line.startswith('p cnf'):
+                return int(line.split()[2]), int(line.split()[3])
+    raise ValueError("No DIMACS header in %s" % path)
+
+def solve_cnf_file(path, backend=None):
+    '''
+    Solves a DIMACS CNF file with the given backend (see choose_backend()).
+    @param: path (str)               CNF file
+    @param: backend (str or None)    backend to use
+    @return: SolverStats object, also kept in LAST_SOLVER_STATS
+    '''
+    global LAST_SOLVER_STATS
+    backend = choose_backend(backend)
+    variables, clauses = cnf_header(path)
+    conflicts = decisions = None
+    if backend == 'kissat':
+        start = time.perf_counter()
+        satisfiable, conflicts, decisions = kissat_stats(path)
+    elif backend == 'pysat':
+        start = time.perf_counter()
+        satisfiable, conflicts, decisions = pysat_stats(path)
+    else:
+        with open(path) as f:
+            cnf = dimacs.load(f)
+        start = time.perf_counter()
+        with config(sat_backend=backend):
+            satisfiable = cnf.satisfiable()
+    LAST_SOLVER_STATS = SolverStats(backend, satisfiable, variables, clauses, conflicts,
+                                    decisions, time.perf_counter() - start)
+    return LAST_SOLVER_STATS
+
+def solve_theory(T, backend=None):
+    '''
+    Solves a compiled theory with the given backend (see choose_backend()).
+    kissat and pysat are run directly on the theory's DIMACS CNF so their statistics
+    can be read.
+    @param: T (NNF object)           theory from E.compile()
+    @param: backend (str or None)    backend to use
+    @return: SolverStats object, also kept in LAST_SOLVER_STATS
+    '''
+    global LAST_SOLVER_STATS
+    backend = choose_backend(backend)
+    if backend in ('kissat', 'pysat'):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'theory.cnf')
+            export_dimacs(T, path)
+            return solve_cnf_file(path, backend)
+    cnf = T.to_CNF()
+    start = time.perf_counter()
+    with config(sat_backend=backend):
+        satisfiable = cnf.satisfiable()
+    LAST_SOLVER_STATS = SolverStats(backend, satisfiable, len(cnf.vars()), len(cnf.children),
+                                    None, None, time.perf_counter() - start)
+    return LAST_SOLVER_STATS
+
+def calibration_solve(task):
+    '''
+    Pool task for calibrate_backends(): solves one (path, backend) pair.
+    @return: seconds the solver took
+    '''
+    return solve_cnf_file(*task).solve_time
+
+def calibrate_backends(paths=None, backends=None, time_limit=CALIBRATION_TIME_LIMIT):
+    '''
+    Times every available backend on a calibration set of DIMACS CNF files and
+    makes 'auto' pick the fastest. Each solve runs in its own process, so one
+    that takes longer than time_limit is stopped and counted as time_limit.
+    @param: paths (list of str or None)     CNF files; defaults to up to CALIBRATION_SIZE
+                                            theories from CNF_CACHE_DIR, or the
+                                            CALIBRATION_PUZZLES synthesis encodings
+                                            if there are none
+    @param: backends (list of str or None)  backends to try (defaults to SAT_BACKENDS)
+    @param: time_limit (float)              most seconds to spend on one solve
+    @return: {backend: total seconds} for the backends that could run
+    '''
+    global AUTO_BACKEND
+    backends = [backend for backend in (backends or SAT_BACKENDS) if backend_available(backend)]
+    if not backends:
+        raise RuntimeError("No SAT backend is available")
+    totals = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if paths is None:
+            paths = []
+            if os.path.isdir(CNF_CACHE_DIR):
+                paths = [os.path.join(CNF_CACHE_DIR, name) for name in sorted(os.listdir(CNF_CACHE_DIR))
+                         if name.endswith('.cnf')][:CALIBRATION_SIZE]
+            if not paths:
+                for i, (t_start, m_start, exit, num_moves) in enumerate(CALIBRATION_PUZZLES):
+                    synthesis = MazeSynthesis(t_start, m_start, exit, num_moves)
+                    synthesis.build()
+                    paths.append(os.path.join(tmp_dir, 'calibration_%d.cnf' % i))
+                    synthesis.write(paths[-1])
+        for backend in backends:
+            totals[backend] = 0.0
+            for path in paths:
+                pool = multiprocessing.Pool(1)
+                try:
+                    totals[backend] += pool.apply_async(calibration_solve,
+                                                        ((path, backend),)).get(time_limit)
+                except multiprocessing.TimeoutError:
+                    totals[backend] += time_limit
+                finally:
+                    pool.terminate()
+                    pool.join()
+    AUTO_BACKEND = min(totals, key=totals.get)
+    return totals
+
+def theory_satisfiable(key=None, backend=None):
+    '''
+    Compiles E and checks whether the theory is satisfiable, printing the encoding
+    size and solver statistics (see SolverStats). If CACHE_THEORIES is on and a
+    puzzle key is given, the theory is saved in CNF_CACHE_DIR as DIMACS CNF, and
+    reruns of the same puzzle hand the saved file straight to the solver without
+    compiling anything.
+    @param: key (str or None)      puzzle_hash() of the puzzle
+    @param: backend (str or None)  SAT backend (see choose_backend())
+    @return: boolean (True if the theory is satisfiable, False otherwise)
+    '''
+    if key is None or not CACHE_THEORIES:
+        T = E.compile()
+        print_encoding_size(T)
+        stats = solve_theory(T, backend)
+    else:
+        path = os.path.join(CNF_CACHE_DIR, key + '.cnf')
+        if os.path.isfile(path):
+            print("Using cached theory %s" % path)
+        else:
+            T = E.compile()
+            print_encoding_size(T)
+            os.makedirs(CNF_CACHE_DIR, exist_ok=True)
+            export_dimacs(T, path, "Theseus and the Minotaur puzzle %s" % key)
+        stats = solve_cnf_file(path, backend)
+    print_solver_stats(stats)
+    return stats.satisfiable
+
+
+def interned(factory):
+    '''
+    Decorator for proposition classes so that creating one with the same arguments
+    twice gives back the same object. There are only BOARD_SIZE * BOARD_SIZE
+    distinct positions, but the search asks for them millions of times. Interned
+    objects are shared, so they must never be modified. Booleans are stored as
+    ints, since True == 1 would otherwise hand back whichever of ThesPos(True, True)
+    and ThesPos(1, 1) happened to be made first.
+    @param: factory (decorated proposition class)
+    @return: function that returns the cached instance for its arguments
+    '''
+    cache = {}
+
+    @wraps(factory)
+    def wrapped(*args):
+        args = tuple(int(arg) if isinstance(arg, bool) else arg for arg in args)
+        instance = cache.get(args)
+        if instance is None:
+            instance = cache[args] = factory(*args)
+        return instance
+
+    return wrapped
+
+
 # Proposition to describe Theseus' current position
+@interned
 @proposition(E)
 class ThesPos:
+    # bauhaus stores the proposition's variable in _var and keeps weak references to it
+    __slots__ = ('x', 'y', '_var', '__weakref__')
+
     def __init__(self, x, y):
         '''
         Constructor to initialize Theseus' x and y position.
@@ -40,14 +515,6 @@ class ThesPos:
         self.x = x
         self.y = y
 
-    def set(self, x, y):
-        '''
-        Sets Theseus' x, y position.
-        @params: x, y (ints) row, col indices
-        '''
-        self.x = x
-        self.y = y
-
     def get(self):
         '''
         No args.
@@ -57,8 +524,11 @@ class ThesPos:
 
 
 # Proposition to describe Minotaur's current position
+@interned
 @proposition(E)
 class MinoPos:
+    __slots__ = ('x', 'y', '_var', '__weakref__')
+
     def __init__(self, x, y):
         '''
         Constructor to initialize Minotaur's x, y position.
@@ -66,14 +536,6 @@ class MinoPos:
         '''
         self.x = x
         self.y = y
-    
-    def set(self, x, y):
-        '''
-        Sets Minotaur's x, y position.
-        @params: x, y (ints), row, col indices
-        '''
-        self.x = x
-        self.y = y
 
     def get(self):
         '''
@@ -87,6 +549,8 @@ class MinoPos:
 @constraint.exactly_one(E)
 @proposition(E)
 class ExitSquare:
+    __slots__ = ('x', 'y', '_var', '__weakref__')
+
     def __init__(self, x, y):
         '''
         Constructor to set the exit square (should never be changed)
@@ -113,6 +577,8 @@ class Hedges:
         No args.
         '''
         self.vert, self.hor = Hedges.set_hedges()
+        # Minotaur threat table, built the first time Theseus' moves are checked
+        self.threats = None
 
     def hedge_grid():
         '''
@@ -157,7 +623,72 @@ class Hedges:
         return vert_hedges, hor_hedges
 
 
+# Proposition for a single hedge segment between two neighbouring squares. Hedges
+# treats the whole layout as one atom; maze synthesis needs one per segment.
+@interned
+@proposition(SYNTHESIS)
+class HedgeSegment:
+    __slots__ = ('kind', 'x', 'y', '_var', '__weakref__')
+
+    def __init__(self, kind, x, y):
+        '''
+        Constructor for the hedge segment right of square (x, y) if kind is 'vert',
+        or on top of it if kind is 'hor' (same layout as Hedges).
+        @param: kind (str)      'vert' or 'hor'
+        @params: x, y (ints)    row, col indices
+        '''
+        self.kind = kind
+        self.x = x
+        self.y = y
+
+    def get(self):
+        '''
+        No args.
+        @return: kind, row, col of the segment
+        '''
+        return self.kind, self.x, self.y
+
+
+def segment_index(kind, x, y):
+    '''
+    Numbers the hedge segments inside the board: first the vertical ones (right of
+    every square but the last column), then the horizontal ones (on top of every
+    square but the first row).
+    @param: kind (str)      'vert' or 'hor'
+    @params: x, y (ints)    row, col indices
+    @return: segment number (int), or None for the board's outer walls
+    '''
+    if kind == 'vert':
+        if not 0 <= y < BOARD_SIZE - 1:
+            return None
+        return x * (BOARD_SIZE - 1) + y
+    if not 0 < x < BOARD_SIZE:
+        return None
+    return BOARD_SIZE * (BOARD_SIZE - 1) + (x - 1) * BOARD_SIZE + y
+
+def hedge_segment(kind, x, y):
+    '''
+    @param: kind (str)      'vert' or 'hor'
+    @params: x, y (ints)    row, col indices
+    @return: the HedgeSegment proposition, or None for the board's outer walls
+    '''
+    if segment_index(kind, x, y) is None:
+        return None
+    return HedgeSegment(kind, x, y)
+
+def hedge_segments():
+    '''
+    No args.
+    @return: list of (kind, row, col) for every segment, in segment_index() order
+    '''
+    return ([('vert', x, y) for x in range(BOARD_SIZE) for y in range(BOARD_SIZE - 1)]
+            + [('hor', x, y) for x in range(1, BOARD_SIZE) for y in range(BOARD_SIZE)])
+
+
 class BoardSquare:
+    __slots__ = ('x', 'y', 't_x', 't_y', 'm_x', 'm_y', 'EXIT_x', 'EXIT_y',
+                 'top', 'bottom', 'right', 'left')
+
     def __init__(self, x, y):
         '''
         Constructor to initialize the given board square
@@ -270,7 +801,7 @@ def thes_win(board, t_pos):
         # so if we pass the condition then we can just clear constraints and force
         # Theseus to be on the exit square
         E.clear_constraints()
-        E.add_constraint((t_pos >> ThesPos(board[t_row][t_col].EXIT_x, board[t_row][t_col].EXIT_y)))
+        add_constraint((t_pos >> ThesPos(t_row, t_col)))
         return True
     return False
 
@@ -286,7 +817,7 @@ def thes_eaten(t_pos, m_pos):
     m_row, m_col = m_pos.get()
     if t_row == m_row and t_col == m_col:
         # Theseus being on this square causes him to lose
-        E.add_constraint((t_pos & m_pos) >> ~t_pos)
+        add_constraint((t_pos & m_pos) >> ~t_pos)
         return True
     return False
 
@@ -395,6 +926,57 @@ class MinoMoves:
         # cover all cases of Minotaur moving squares, but we can always remove it
         return False
 
+    def mino_step(board, m_row, m_col, t_row, t_col):
+        '''
+        One step of the Minotaur's algorithm (see mino_move()), without adding any constraints.
+        @param: board (2D array of Board_Square objects)  board to take the hedges from
+        @params: m_row, m_col, t_row, t_col (ints)        the Minotaur's and Theseus' squares
+        @return: the Minotaur's new (row, col)
+        '''
+        # First check horizontal moves: Theseus to the right, then to the left
+        if t_col > m_col and not MinoMoves.mino_hedges_in_way(board, m_row, m_col + 1, m_row, m_col):
+            return m_row, m_col + 1
+        elif t_col < m_col and not MinoMoves.mino_hedges_in_way(board, m_row, m_col - 1, m_row, m_col):
+            return m_row, m_col - 1
+        # Otherwise, the Minotaur can't get closer to Theseus by moving horizontally, so he
+        # tries to move vertically: Theseus below, then above
+        elif t_row > m_row and not MinoMoves.mino_hedges_in_way(board, m_row + 1, m_col, m_row, m_col):
+            return m_row + 1, m_col
+        elif t_row < m_row and not MinoMoves.mino_hedges_in_way(board, m_row - 1, m_col, m_row, m_col):
+            return m_row - 1, m_col
+        # If none of the above work, the Minotaur skips his turn
+        return m_row, m_col
+
+    def threat_mask(board, m_row, m_col):
+        '''
+        Works out which squares the Minotaur can reach in his two-step turn from the
+        given square, given the hedges. Squares are numbered row * size + col.
+        @param: board (2D array of Board_Square objects)  board to take the hedges from
+        @param: m_row, m_col (ints)                       the Minotaur's square
+        @return: bitmask (int) with bit n set if square n is threatened
+        '''
+        size = len(board)
+        mask = 0
+        # The Minotaur never reaches further than 2 squares in any direction
+        for targ_row in range(max(m_row - 2, 0), min(m_row + 3, size)):
+            for targ_col in range(max(m_col - 2, 0), min(m_col + 3, size)):
+                if (ThesMoves.mino_within_range(targ_row, targ_col, m_row, m_col)
+                        and not MinoMoves.mino_hedges_in_way(board, targ_row, targ_col,
+                                                            m_row, m_col)):
+                    mask |= 1 << (targ_row * size + targ_col)
+        return mask
+
+    def threat_masks(board):
+        '''
+        Precomputes threat_mask() for every square the Minotaur can stand on, so
+        checking whether a candidate square is safe is a single lookup.
+        @param: board (2D array of Board_Square objects)  board to take the hedges from
+        @return: list of bitmasks indexed by the Minotaur's square number
+        '''
+        size = len(board)
+        return [MinoMoves.threat_mask(board, m_row, m_col)
+                for m_row in range(size) for m_col in range(size)]
+
     def mino_move(board, m_pos, t_pos, hedges):
         """
         Defines the Minotaur's move according to the algorithm below.
@@ -412,42 +994,9 @@ class MinoMoves:
         """
         mino_row, mino_col = m_pos.get()
         thes_row, thes_col = t_pos.get()
-        # Calculate the distances w.r.t. rows and columns between Theseus and Minotaur
-        row_diff = mino_row - thes_row
-        col_diff = mino_col - thes_col
-
-        # First check horizontal moves
-        # Theseus to right of Minotaur
-        if col_diff < 0 and not MinoMoves.mino_hedges_in_way(board, mino_row, mino_col + 1,
-                                                    mino_row, mino_col):
-            # The Minotaur should move one square to the right
-            E.add_constraint((m_pos & t_pos & hedges) >> MinoPos(mino_row, mino_col+1))
-            return tuple([mino_row, mino_col + 1])
-        # Theseus to left of Minotaur
-        elif col_diff > 0 and not MinoMoves.mino_hedges_in_way(board, mino_row, mino_col - 1,
-                                                    mino_row, mino_col):
-            # The Minotaur should move one square to the left
-            E.add_constraint((m_pos & t_pos & hedges) >> MinoPos(mino_row, mino_col-1))
-            return tuple([mino_row, mino_col - 1])
-
-        # Otherwise, the Minotaur can't get closer to Theseus by moving horizontally, so he tries
-        # to move vertically. If he moves vertically and gets closer to Theseus, row_diff should decrease.
-        else:  # includes col_diff == 0
-            # Theseus below the Minotaur
-            if row_diff < 0 and not MinoMoves.mino_hedges_in_way(board, mino_row + 1, mino_col,
-                                                    mino_row, mino_col):
-                # Minotaur should move one down
-                E.add_constraint((m_pos & t_pos & hedges) >> MinoPos(mino_row+1, mino_col))
-                return tuple([mino_row + 1, mino_col])
-            # Theseus above the Minotaur
-            elif row_diff > 0 and not MinoMoves.mino_hedges_in_way(board, mino_row - 1, mino_col,
-                                                        mino_row, mino_col):
-                # Minotaur should move one up
-                E.add_constraint((m_pos & t_pos & hedges) >> MinoPos(mino_row-1, mino_col))
-                return tuple([mino_row - 1, mino_col])
-        # If none of the above work, the Minotaur skips his turn.
-        E.add_constraint((m_pos & t_pos & hedges) >> MinoPos(mino_row, mino_col))
-        return tuple([mino_row, mino_col])
+        new_row, new_col = MinoMoves.mino_step(board, mino_row, mino_col, thes_row, thes_col)
+        add_constraint((m_pos & t_pos & hedges) >> MinoPos(new_row, new_col))
+        return tuple([new_row, new_col])
 
 
 # Group of functions to generate possible moves for Theseus
@@ -510,51 +1059,53 @@ class ThesMoves:
 
         # Check if the target square is out of bounds
         if not ThesMoves.within_borders(target_row, target_col):
-            E.add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
+            add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
             return False
 
         # Check if there are hedges preventing Theseus from moving to the target square.
         # Target square 1 to right of Theseus' current position.
         if target_row == thes_row and target_col == thes_col + 1 and board[
             thes_row][thes_col].right:
-            E.add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
+            add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
             return False
         # Target square 1 to left
         elif target_row == thes_row and target_col == thes_col - 1 and board[
             thes_row][thes_col].left:
-            E.add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
+            add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
             return False
         # Target square 1 up
         elif target_row == thes_row - 1 and target_col == thes_col and board[
             thes_row][thes_col].top:
-            E.add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
+            add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
             return False
         # Target square 1 down
         elif target_row == thes_row + 1 and target_col == thes_col and board[
             thes_row][thes_col].bottom:
-            E.add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
+            add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
             return False
 
         # DON'T-GET-EATEN CONSTRAINTS HERE #
 
         # Check if Theseus is moving onto the Minotaur's square... obviously bad idea
         if target_row == mino_row and target_col == mino_col:
-            E.add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
+            add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
             return False
 
         # Check if Theseus is moving onto the exit - then we don't need to check
         # if the Minotaur is in range 
         if thes_win(board, targ_pos):
-            E.add_constraint((t_pos & m_pos & hedges) >> targ_pos)
+            add_constraint((t_pos & m_pos & hedges) >> targ_pos)
             return True
 
         # Theseus can move within 2 squares horizontally or vertically or 1 square diagonally of
-        # Minotaur and be safe if there are hedges between him and the Minotaur.
-        if ThesMoves.mino_within_range(target_row, target_col, mino_row, mino_col):
-            if not MinoMoves.mino_hedges_in_way(board, target_row, target_col, mino_row,
-                                    mino_col):
-                E.add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
-                return False
+        # Minotaur and be safe if there are hedges between him and the Minotaur. The hedges
+        # never change, so which squares are in reach is worked out once per maze.
+        if hedges.threats is None:
+            hedges.threats = MinoMoves.threat_masks(board)
+        mino_square = mino_row * BOARD_SIZE + mino_col
+        if hedges.threats[mino_square] >> (target_row * BOARD_SIZE + target_col) & 1:
+            add_constraint((t_pos & m_pos & hedges) >> ~targ_pos)
+            return False
 
         # If we reach this point, the square is OK.
         return True
@@ -589,6 +1140,72 @@ class ThesMoves:
         return moves
 
 
+# Number of calls is_winnable() has made (for benchmarking); reset it before a run
+NODES_EXPANDED = 0
+# SearchTracer recording is_winnable()'s nodes, if any (see SearchTracer)
+TRACER = None
+
+
+class SearchTracer:
+    def __init__(self, path):
+        '''
+        Records every node is_winnable() expands to a JSONL file, one line per node
+        written when its search finishes: id, parent id, depth (round number),
+        Theseus' and the Minotaur's squares, the move Theseus made to get there,
+        whether he can win from it, seconds spent and number of nodes in its subtree.
+        Use it as a context manager around the search:
+            with SearchTracer('trace.jsonl'):
+                is_winnable(...)
+        then summarize the file with trace_summary.py.
+        @param: path (str)  file to write the trace to
+        '''
+        self.path = path
+        self.file = None
+        self.next_id = 0
+        # [id, Theseus' square, subtree size so far] for each node being searched
+        self.stack = []
+
+    def __enter__(self):
+        global TRACER
+        self.file = open(self.path, 'w')
+        TRACER = self
+        return self
+
+    def __exit__(self, *exc):
+        global TRACER
+        TRACER = None
+        self.file.close()
+
+    def trace(self, search, board, t_pos, m_pos, exit, hedges, round_num):
+        '''
+        Runs search (the body of is_winnable()) on one node and records it.
+        @return: whatever search returns
+        '''
+        node_id = self.next_id
+        self.next_id += 1
+        t = t_pos.get()
+        move = None
+        parent = None
+        if self.stack:
+            parent, parent_t, size = self.stack[-1]
+            move = MOVE_NAMES[MOVE_OFFSETS.index((t[0] - parent_t[0], t[1] - parent_t[1]))]
+        node = [node_id, t, 1]
+        self.stack.append(node)
+        start = time.perf_counter()
+        try:
+            result = search(board, t_pos, m_pos, exit, hedges, round_num)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1][2] += node[2]
+        self.file.write(json.dumps({'id': node_id, 'parent': parent, 'depth': round_num,
+                                    't': list(t), 'm': list(m_pos.get()), 'move': move,
+                                    'won': result, 'time': round(elapsed, 7),
+                                    'size': node[2]}, separators=(',', ':')) + '\n')
+        return result
+
+
 def is_winnable(board, t_pos, m_pos, exit, hedges, round_num=0):
     '''
     Determines recursively whether Theseus can win, given a certain board configuration.
@@ -609,63 +1226,1603 @@ def is_winnable(board, t_pos, m_pos, exit, hedges, round_num=0):
     @param: round_num (int)                           round the game is on; increments with each turn
     @return: boolean (True if Theseus can win, False otherwise)
     '''
-    t_row, t_col = t_pos.get()
-    m_row, m_col = m_pos.get()
+    if TRACER is None:
+        return expand_node(board, t_pos, m_pos, exit, hedges, round_num)
+    return TRACER.trace(expand_node, board, t_pos, m_pos, exit, hedges, round_num)
+
+def expand_node(board, t_pos, m_pos, exit, hedges, round_num):
+    '''
+    Body of is_winnable(), which may wrap it in a SearchTracer.
+    '''
+    global NODES_EXPANDED
+    NODES_EXPANDED += 1
     exit_x, exit_y = exit.get()
     # If Theseus has been eaten by the Minotaur
     if thes_eaten(t_pos, m_pos):
-        E.add_constraint((t_pos & m_pos & hedges) >> ~t_pos)
+        add_constraint((t_pos & m_pos & hedges) >> ~t_pos)
         return False
     # If Theseus' position is the exit and the Minotaur is not there
     if thes_win(board, t_pos):
-        E.add_constraint((t_pos & m_pos & hedges) >> t_pos)
+        add_constraint((t_pos & m_pos & hedges) >> t_pos)
         return True
     # Theseus has run out of turns
     if round_num >= NUM_ROUNDS:
-        E.add_constraint((t_pos & m_pos & hedges) >> ~t_pos)
+        add_constraint((t_pos & m_pos & hedges) >> ~t_pos)
         return False
     else:
         # Get a list of Theseus' moves
         moves = ThesMoves.theseus_moves(board, t_pos, m_pos, hedges)
         # If the moves list is empty
         if not moves:
-            E.add_constraint((t_pos & m_pos & hedges) >> ~t_pos)
+            add_constraint((t_pos & m_pos & hedges) >> ~t_pos)
             return False
         else:
             # We already validated the moves list so that no moves that get Theseus
             # eaten immediately are included, so if the exit square is in the moves list,
             # he wins
             if tuple([exit_x, exit_y]) in moves:
-                E.add_constraint((t_pos & m_pos & hedges) >> t_pos)
+                add_constraint((t_pos & m_pos & hedges) >> t_pos)
                 return True
-            # Check each move in the moves list
-            move = moves[0]
-            while moves:
+            # Check each move in the moves list. Positions are shared (see interned()),
+            # so each move gets new position objects rather than changing t_pos and m_pos.
+            for move in moves:
                 # Have Theseus move once and the Minotaur move twice
                 t_new_pos = ThesPos(move[0], move[1])
-                t_pos.set(move[0], move[1])
-                # Now have the Minotaur move
-                m_turn1 = MinoMoves.mino_move(board, m_pos, t_pos, hedges)
-                m_pos.set(m_turn1[0], m_turn1[1])
-                m_turn2 = MinoMoves.mino_move(board, m_pos, t_pos, hedges)
-                m_pos.set(m_turn2[0], m_turn2[1])
-                # Set the board according to new positions and increment the round number by 1
-                board = set_board(board, t_pos, m_pos)
-                round_num += 1
+                m_turn1 = MinoMoves.mino_move(board, m_pos, t_new_pos, hedges)
+                m_turn2 = MinoMoves.mino_move(board, MinoPos(m_turn1[0], m_turn1[1]), t_new_pos, hedges)
+                m_new_pos = MinoPos(m_turn2[0], m_turn2[1])
+                # Set the board according to new positions and go to the next round
+                board = set_board(board, t_new_pos, m_new_pos)
                 # If Theseus can eventually win, return True - no need to check anything else
-                if is_winnable(board, t_pos, m_pos, exit, hedges, round_num):
-                    E.add_constraint((t_pos & m_pos & hedges) >> t_pos)
+                if is_winnable(board, t_new_pos, m_new_pos, exit, hedges, round_num + 1):
+                    add_constraint((t_new_pos & m_new_pos & hedges) >> t_new_pos)
                     return True
                 # If Theseus can't win with this move, go on to the next move
+                add_constraint((t_pos & m_pos & hedges) >> ~t_new_pos)
+            return False
+
+
+# Constraint-free view of a maze for fast searching. is_winnable() adds constraints
+# to E as it goes, so it can only ever run in this process; a StateSpace only holds
+# plain tables built from the hedges, so it can be handed to worker processes.
+class StateSpace:
+    def __init__(self, board, exit_x, exit_y):
+        '''
+        Builds the move tables for the given maze. Squares are numbered
+        row * size + col, and a game state is a (Theseus square, Minotaur square) pair.
+        @param: board (2D array of Board_Square objects)  maze to search (only the hedges are used)
+        @param: exit_x, exit_y (ints)                     exit square
+        '''
+        size = len(board)
+        self.size = size
+        self.num_squares = size * size
+        self.exit = exit_x * size + exit_y
+        self.exit_dist = None
+        # Squares each Minotaur square threatens (see MinoMoves.threat_mask())
+        self.threats = [0] * self.num_squares
+        # Squares Theseus can step to from each square ignoring the Minotaur, in the
+        # same order ThesMoves.theseus_moves() tries them: up, down, right, left, stay
+        self.steps = [None] * self.num_squares
+        # Whether the Minotaur can take a single step up/down/left/right from each square
+        self.open_up = [False] * self.num_squares
+        self.open_down = [False] * self.num_squares
+        self.open_left = [False] * self.num_squares
+        self.open_right = [False] * self.num_squares
+        for row in range(size):
+            for col in range(size):
+                self.build_square(board, row, col)
+
+    def build_square(self, board, row, col):
+        '''
+        (Re)builds the tables for one square from the board's hedges. After changing
+        hedges, call this for every square within 1 square of them (diagonals included).
+        @param: board (2D array of Board_Square objects)  board to take the hedges from
+        @params: row, col (ints)                          the square
+        '''
+        size = self.size
+        square = board[row][col]
+        n = row * size + col
+        steps = []
+        if row - 1 >= 0 and not square.top:
+            steps.append(n - size)
+        if row + 1 < size and not square.bottom:
+            steps.append(n + size)
+        if col + 1 < size and not square.right:
+            steps.append(n + 1)
+        if col - 1 >= 0 and not square.left:
+            steps.append(n - 1)
+        steps.append(n)
+        self.steps[n] = steps
+        self.threats[n] = MinoMoves.threat_mask(board, row, col)
+        self.open_up[n] = not MinoMoves.mino_hedges_in_way(board, row - 1, col, row, col)
+        self.open_down[n] = not MinoMoves.mino_hedges_in_way(board, row + 1, col, row, col)
+        self.open_left[n] = not MinoMoves.mino_hedges_in_way(board, row, col - 1, row, col)
+        self.open_right[n] = not MinoMoves.mino_hedges_in_way(board, row, col + 1, row, col)
+        # Distances to the exit may have changed
+        self.exit_dist = None
+
+    def square(self, row, col):
+        '''
+        @params: row, col (ints) row, col indices
+        @return: square number (int) used by the tables
+        '''
+        return row * self.size + col
+
+    def theseus_moves(self, t, m):
+        '''
+        Same rules as ThesMoves.theseus_moves(), without adding any constraints.
+        @param: t, m (ints)  Theseus' and the Minotaur's squares
+        @return: list of squares Theseus can safely move to (empty if he loses)
+        '''
+        threats = self.threats[m]
+        return [move for move in self.steps[t]
+                if move != m and (move == self.exit or not threats >> move & 1)]
+
+    def minotaur_step(self, m, t):
+        '''
+        One step of the Minotaur's algorithm (see MinoMoves.mino_move()).
+        @param: m, t (ints)  the Minotaur's and Theseus' squares
+        @return: the Minotaur's new square (int)
+        '''
+        m_row, m_col = divmod(m, self.size)
+        t_row, t_col = divmod(t, self.size)
+        if t_col > m_col and self.open_right[m]:
+            return m + 1
+        elif t_col < m_col and self.open_left[m]:
+            return m - 1
+        elif t_row > m_row and self.open_down[m]:
+            return m + self.size
+        elif t_row < m_row and self.open_up[m]:
+            return m - self.size
+        return m
+
+    def exit_distances(self):
+        '''
+        Hedge-aware distance from every square to the exit for Theseus, ignoring the
+        Minotaur (computed the first time it's asked for). Unreachable squares are None.
+        @return: list of distances indexed by square
+        '''
+        if self.exit_dist is None:
+            dist = [None] * self.num_squares
+            dist[self.exit] = 0
+            queue = [self.exit]
+            # Theseus' steps are symmetric (a hedge blocks both sides), so searching
+            # outwards from the exit gives the distance to it
+            for square in queue:
+                for step in self.steps[square]:
+                    if dist[step] is None:
+                        dist[step] = dist[square] + 1
+                        queue.append(step)
+            self.exit_dist = dist
+        return self.exit_dist
+
+    def minotaur_turn(self, m, t):
+        '''
+        @param: m, t (ints)  the Minotaur's and Theseus' squares
+        @return: the Minotaur's square (int) after both of his moves
+        '''
+        return self.minotaur_step(self.minotaur_step(m, t), t)
+
+
+class SearchStopped(Exception):
+    '''
+    Raised inside EscapeSearch when its cancel flag is set or it runs out of budget.
+    '''
+
+
+class TranspositionTable:
+    # Each entry packs (state + 1) above DEPTH_BITS bits of rounds into one 64-bit
+    # word; 0 is an empty slot
+    DEPTH_BITS = 16
+    DEPTH_MASK = (1 << DEPTH_BITS) - 1
+    MAX_STATE = (1 << (64 - DEPTH_BITS)) - 2
+
+    def __init__(self, capacity):
+        '''
+        Fixed-size replacement for EscapeSearch's dict of failed states, for boards
+        too big to remember every state. Entries live in buckets of two slots: the
+        first keeps the entry with the most rounds (the biggest subtree proven to
+        fail), the second always takes the newest entry. Losing an entry only means
+        its state may be searched again, so the search's answers don't change.
+        Supports the two dict operations EscapeSearch uses: get() and item assignment.
+        @param: capacity (int)  number of entries (rounded up to a power of two, at
+                                least 2); takes 8 bytes each
+        '''
+        bucket_bits = max(0, ((capacity + 1) // 2 - 1).bit_length())
+        self.num_buckets = 1 << bucket_bits
+        # Buckets are numbered by the top bucket_bits bits of the hashed state
+        self.shift = 64 - bucket_bits
+        self.slots = array('Q', bytes(16 * self.num_buckets))
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def bucket(self, state):
+        '''
+        @return: index (int) of the state's first slot
+        '''
+        # Fibonacci hashing: the top bits of the product depend on every bit of the
+        # state, so neighbouring states are spread over the table
+        return 2 * ((state * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF) >> self.shift)
+
+    def get(self, state, default=-1):
+        '''
+        @param: state (int)    t * num_squares + m
+        @param: default        returned if the state isn't in the table
+        @return: most rounds the state is known not to be enough for, or default
+        '''
+        self.lookups += 1
+        key = state + 1
+        at = self.bucket(state)
+        for entry in (self.slots[at], self.slots[at + 1]):
+            if entry >> self.DEPTH_BITS == key:
+                self.hits += 1
+                return entry & self.DEPTH_MASK
+        return default
+
+    def __setitem__(self, state, rounds):
+        '''
+        Records that rounds are not enough to escape from the state.
+        '''
+        if not 0 <= state <= self.MAX_STATE:
+            raise ValueError("State %d doesn't fit in a transposition table entry" % state)
+        self.stores += 1
+        key = state + 1
+        rounds = min(rounds, self.DEPTH_MASK)
+        slots = self.slots
+        at = self.bucket(state)
+        first, second = slots[at], slots[at + 1]
+        if first >> self.DEPTH_BITS == key:
+            slots[at] = key << self.DEPTH_BITS | max(rounds, first & self.DEPTH_MASK)
+            return
+        if second >> self.DEPTH_BITS == key:
+            rounds = max(rounds, second & self.DEPTH_MASK)
+            # Make room in the second slot; it's taken again below
+            second = 0
+        entry = key << self.DEPTH_BITS | rounds
+        if rounds >= first & self.DEPTH_MASK:
+            # The first slot's old entry moves down to replace the second one
+            if second and first:
+                self.evictions += 1
+            slots[at], slots[at + 1] = entry, first or second
+        else:
+            if second:
+                self.evictions += 1
+            slots[at + 1] = entry
+
+    def hit_rate(self):
+        '''
+        No args.
+        @return: fraction of lookups that found their state (float)
+        '''
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self):
+        '''
+        No args.
+        @return: dict with the table's size and how it has been used
+        '''
+        return {'capacity': 2 * self.num_buckets, 'bytes': self.slots.itemsize * len(self.slots),
+                'lookups': self.lookups, 'hits': self.hits, 'hit rate': self.hit_rate(),
+                'stores': self.stores, 'evictions': self.evictions}
+
+
+class EscapeSearch:
+    def __init__(self, space, cancel=None, deadline=None, node_limit=None, table=None):
+        '''
+        Depth-first search for Theseus' escape over a StateSpace. Follows the same
+        rules as is_winnable(), but remembers which states have already failed
+        so revisiting them is free.
+        @param: space (StateSpace object)                 maze to search
+        @param: cancel (multiprocessing.Event or None)    stops the search once set
+        @param: deadline (float or None)                  time.monotonic() value to stop at
+        @param: node_limit (int or None)                  number of nodes to stop after
+        @param: table (TranspositionTable or None)        where to remember failed states,
+                                                          to bound memory on big boards
+                                                          (a dict if None)
+        '''
+        self.space = space
+        self.cancel = cancel
+        self.deadline = deadline
+        self.node_limit = node_limit
+        # Most rounds each state (t * num_squares + m) is known not to be enough
+        self.failed = {} if table is None else table
+        self.nodes = 0
+        # Closest Theseus has got to the exit (hedge-aware distance) in any state visited
+        self.closest = None
+
+    def winnable(self, t, m, rounds):
+        '''
+        @param: t, m (ints)    Theseus' and the Minotaur's squares
+        @param: rounds (int)   rounds Theseus has left
+        @return: True if Theseus can escape, False if not, None if stopped early
+        '''
+        if self.cancel is not None and self.cancel.is_set():
+            return None
+        try:
+            return self.search(t, m, rounds)
+        except SearchStopped:
+            return None
+
+    def search(self, t, m, rounds):
+        '''
+        Recursive part of winnable(). Same base cases as is_winnable().
+        '''
+        self.nodes += 1
+        if self.nodes % CANCEL_CHECK_INTERVAL == 0:
+            if self.cancel is not None and self.cancel.is_set():
+                raise SearchStopped
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                raise SearchStopped
+        if self.node_limit is not None and self.nodes > self.node_limit:
+            raise SearchStopped
+        space = self.space
+        if t == m:
+            return False
+        if space.exit_dist is not None:
+            dist = space.exit_dist[t]
+            if dist is not None and (self.closest is None or dist < self.closest):
+                self.closest = dist
+        if t == space.exit:
+            return True
+        if rounds <= 0:
+            return False
+        state = t * space.num_squares + m
+        if self.failed.get(state, -1) >= rounds:
+            return False
+        moves = space.theseus_moves(t, m)
+        if space.exit in moves:
+            return True
+        for move in moves:
+            if self.search(move, space.minotaur_turn(m, move), rounds - 1):
+                return True
+        self.failed[state] = rounds
+        return False
+
+
+class SolveResult:
+    def __init__(self, status, horizon, moves, closest, nodes, elapsed):
+        '''
+        Answer from solve_with_budget().
+        @param: status (str)            WINNABLE, NOT_WINNABLE or UNKNOWN (budget ran out)
+        @param: horizon (int)           most rounds proven not to be enough to escape
+                                        (-1 if nothing was proven)
+        @param: moves (int or None)     fewest rounds needed to escape, if winnable
+        @param: closest (int or None)   closest Theseus got to the exit (hedge-aware distance)
+        @param: nodes (int)             nodes expanded
+        @param: elapsed (float)         seconds spent
+        '''
+        self.status = status
+        self.horizon = horizon
+        self.moves = moves
+        self.closest = closest
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return ("SolveResult(status=%r, horizon=%d, moves=%r, closest=%r, nodes=%d, elapsed=%.3f)"
+                % (self.status, self.horizon, self.moves, self.closest, self.nodes, self.elapsed))
+
+
+def solve_with_budget(space, t, m, rounds, time_limit=None, node_limit=None, table=None):
+    '''
+    Anytime version of EscapeSearch.winnable() that gives up once it runs out of time
+    or nodes instead of running unbounded. It tries 0, 1, 2, ... rounds in turn (states
+    that failed stay remembered between tries), so when the budget runs out it can
+    still say how many rounds are definitely not enough.
+    @param: space (StateSpace object)   maze to search
+    @param: t, m (ints)                 Theseus' and the Minotaur's starting squares
+    @param: rounds (int)                number of rounds Theseus has
+    @param: time_limit (float or None)  wall-clock budget in seconds
+    @param: node_limit (int or None)    budget in expanded nodes
+    @param: table (TranspositionTable or None)  memory-bounded store of failed states
+    @return: SolveResult object
+    '''
+    start = time.monotonic()
+    deadline = None if time_limit is None else start + time_limit
+    space.exit_distances()
+    search = EscapeSearch(space, deadline=deadline, node_limit=node_limit, table=table)
+    horizon = -1
+    status = NOT_WINNABLE
+    moves = None
+    for h in range(rounds + 1):
+        # The search only looks at the clock every CANCEL_CHECK_INTERVAL nodes, and the
+        # shallow tries can finish well before that, so check the budget between tries too
+        if ((deadline is not None and time.monotonic() >= deadline)
+                or (node_limit is not None and search.nodes >= node_limit)):
+            status = UNKNOWN
+            break
+        result = search.winnable(t, m, h)
+        if result is None:
+            status = UNKNOWN
+            break
+        if result:
+            status = WINNABLE
+            moves = h
+            break
+        horizon = h
+    closest = 0 if status == WINNABLE else search.closest
+    return SolveResult(status, horizon, moves, closest, search.nodes, time.monotonic() - start)
+
+
+def min_rounds(space, t, m):
+    '''
+    Finds the fewest rounds Theseus needs to escape with one breadth-first search
+    over game states, so escaping within NUM_ROUNDS rounds is just
+    min_rounds(...) <= NUM_ROUNDS (with the same rules as is_winnable()).
+    @param: space (StateSpace object)  maze to search
+    @param: t, m (ints)                Theseus' and the Minotaur's starting squares
+    @return: fewest rounds needed (int), or None if Theseus can never escape
+    '''
+    if t == m:
+        return None
+    if t == space.exit:
+        return 0
+    num_squares = space.num_squares
+    seen = {t * num_squares + m}
+    layer = [(t, m)]
+    rounds = 0
+    while layer:
+        rounds += 1
+        next_layer = []
+        for t_sq, m_sq in layer:
+            moves = space.theseus_moves(t_sq, m_sq)
+            if space.exit in moves:
+                return rounds
+            for move in moves:
+                m_next = space.minotaur_turn(m_sq, move)
+                state = move * num_squares + m_next
+                # Theseus is eaten in states where the Minotaur catches him
+                if move != m_next and state not in seen:
+                    seen.add(state)
+                    next_layer.append((move, m_next))
+        layer = next_layer
+    return None
+
+
+def solve_all_states(space):
+    '''
+    Works out, for every (Theseus, Minotaur) state of the maze, the fewest rounds
+    Theseus needs to escape and the move that gets him there, by searching
+    backwards from the moves that reach the exit.
+    @param: space (StateSpace object)  maze to solve
+    @return: (dist, moves) lists indexed by t * num_squares + m. dist is NEVER if
+    Theseus can't escape; moves holds indices into MOVE_NAMES, or NO_MOVE
+    '''
+    num_squares = space.num_squares
+    size = space.size
+    num_states = num_squares * num_squares
+    dist = [NEVER] * num_states
+    moves = [NO_MOVE] * num_states
+    # States each state can be reached from, with the move that gets there
+    preds = [[] for state in range(num_states)]
+    queue = []
+    for t in range(num_squares):
+        for m in range(num_squares):
+            state = t * num_squares + m
+            if t == m:
+                continue
+            if t == space.exit:
+                dist[state] = 0
+                continue
+            t_row, t_col = divmod(t, size)
+            for move in space.theseus_moves(t, m):
+                move_row, move_col = divmod(move, size)
+                code = MOVE_OFFSETS.index((move_row - t_row, move_col - t_col))
+                if move == space.exit:
+                    if dist[state] != 1:
+                        dist[state] = 1
+                        moves[state] = code
+                        queue.append(state)
+                    continue
+                m_next = space.minotaur_turn(m, move)
+                if move != m_next:
+                    preds[move * num_squares + m_next].append((state, code))
+    # Breadth-first from the states one move from the exit
+    for state in queue:
+        for pred, code in preds[state]:
+            if dist[pred] == NEVER:
+                dist[pred] = dist[state] + 1
+                moves[pred] = code
+                queue.append(pred)
+    return dist, moves
+
+def strategy_table(space):
+    '''
+    Packs solve_all_states() into a flat byte string: a STRATEGY_HEADER, then one
+    move byte per state, then one little-endian 16-bit distance per state.
+    @param: space (StateSpace object)  maze to solve
+    @return: bytes
+    '''
+    dist, moves = solve_all_states(space)
+    dist = array('H', dist)
+    if sys.byteorder != 'little':
+        dist.byteswap()
+    header = STRATEGY_HEADER.pack(STRATEGY_MAGIC, 1, space.size, space.exit)
+    return header + bytes(moves) + dist.tobytes()
+
+def save_strategy_table(space, path):
+    '''
+    Writes strategy_table(space) to a file.
+    '''
+    with open(path, 'wb') as f:
+        f.write(strategy_table(space))
+
+def load_strategy_table(path):
+    '''
+    @param: path (str)  file written by save_strategy_table()
+    @return: StrategyTable object
+    '''
+    with open(path, 'rb') as f:
+        return StrategyTable(f.read())
+
+def map_strategy_table(path):
+    '''
+    Like load_strategy_table(), but maps the file into memory instead of reading
+    it, so only the parts hints look at are ever loaded. Use this for big tables.
+    @param: path (str)  file written by save_strategy_table() or solve_to_file()
+    @return: StrategyTable object
+    '''
+    with open(path, 'rb') as f:
+        return StrategyTable(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class StrategyTable:
+    def __init__(self, data):
+        '''
+        Serves hints from a table built by strategy_table(), by index arithmetic only.
+        @param: data (bytes-like)  the table
+        '''
+        magic, version, size, exit = STRATEGY_HEADER.unpack_from(data, 0)
+        if magic != STRATEGY_MAGIC or version != 1:
+            raise ValueError("Not a strategy table")
+        self.size = size
+        self.exit = exit
+        self.num_squares = size * size
+        self.data = memoryview(data)
+        self.moves_at = STRATEGY_HEADER.size
+        self.dist_at = self.moves_at + self.num_squares * self.num_squares
+
+    def distance(self, state):
+        '''
+        @param: state (int)  t * num_squares + m
+        @return: fewest rounds needed to escape from the state, or NEVER
+        '''
+        at = self.dist_at + 2 * state
+        return self.data[at] | self.data[at + 1] << 8
+
+    def hint(self, t_row, t_col, m_row, m_col):
+        '''
+        What should Theseus do now?
+        @params: t_row, t_col, m_row, m_col (ints)  Theseus' and the Minotaur's squares
+        @return: (row, col, rounds) - the square Theseus should move to and the
+        fewest rounds he then needs to escape (counting this one), or None if he
+        can't escape. If he is already on the exit, that square with 0 rounds.
+        '''
+        t = t_row * self.size + t_col
+        state = t * self.num_squares + m_row * self.size + m_col
+        rounds = self.distance(state)
+        if rounds == NEVER:
+            return None
+        code = self.data[self.moves_at + state]
+        if code == NO_MOVE:
+            return t_row, t_col, rounds
+        row_step, col_step = MOVE_OFFSETS[code]
+        return t_row + row_step, t_col + col_step, rounds
+
+
+def solve_to_file(space, path, chunk_states=1 << 18):
+    '''
+    Out-of-core solve_all_states() for boards whose state tables don't fit in memory.
+    Writes the same file as save_strategy_table(), working on it through memory-mapped
+    NumPy arrays. Distances are found one layer at a time (the states 1 round from
+    the exit, then 2, ...), each layer in one pass over the Theseus squares one move
+    from a square that got states in the layer before, in chunks of whole squares.
+    Only one chunk and the per-square tables are in memory. A state's successors
+    have Theseus on a neighbouring square, so the distances a chunk looks up sit
+    close to the chunk in the file.
+    @param: space (StateSpace object)  maze to solve
+    @param: path (str)                 file to write
+    @param: chunk_states (int)         roughly how many states to work on at once
+    @return: StrategyTable object mapped from the finished file
+    '''
+    if np is None:
+        raise ImportError("solve_to_file() needs NumPy")
+    size = space.size
+    num_squares = space.num_squares
+    num_states = num_squares * num_squares
+    exit = space.exit
+    header = STRATEGY_HEADER.pack(STRATEGY_MAGIC, 1, size, exit)
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.truncate(len(header) + 3 * num_states)
+    moves = np.memmap(path, dtype=np.uint8, mode='r+', offset=len(header), shape=(num_states,))
+    dist = np.memmap(path, dtype='<u2', mode='r+', offset=len(header) + num_states,
+                     shape=(num_states,))
+
+    # Per-square tables: where each of Theseus' moves leads (-1 if a hedge or the
+    # edge is in the way), which squares of the 5x5 window around the Minotaur he
+    # threatens, and which single steps the Minotaur can take
+    targets = np.full((num_squares, len(MOVE_OFFSETS)), -1, dtype=np.int64)
+    window = np.zeros((num_squares, 25), dtype=bool)
+    for square in range(num_squares):
+        row, col = divmod(square, size)
+        for move in space.steps[square]:
+            move_row, move_col = divmod(move, size)
+            targets[square, MOVE_OFFSETS.index((move_row - row, move_col - col))] = move
+        for targ_row in range(max(row - 2, 0), min(row + 3, size)):
+            for targ_col in range(max(col - 2, 0), min(col + 3, size)):
+                if space.threats[square] >> (targ_row * size + targ_col) & 1:
+                    window[square, (targ_row - row + 2) * 5 + targ_col - col + 2] = True
+    open_up, open_down, open_left, open_right = (np.array(table, dtype=bool) for table in
+                                                 (space.open_up, space.open_down,
+                                                  space.open_left, space.open_right))
+
+    def minotaur_step(m, t):
+        # StateSpace.minotaur_step() on arrays of squares
+        m_row, m_col = np.divmod(m, size)
+        t_row, t_col = np.divmod(t, size)
+        right = (t_col > m_col) & open_right[m]
+        left = ~right & (t_col < m_col) & open_left[m]
+        down = ~right & ~left & (t_row > m_row) & open_down[m]
+        up = ~right & ~left & ~down & (t_row < m_row) & open_up[m]
+        return m + right.astype(np.int64) - left + size * (down.astype(np.int64) - up)
+
+    chunk_squares = max(1, chunk_states // num_squares)
+    for start in range(0, num_squares, chunk_squares):
+        end = min(start + chunk_squares, num_squares)
+        dist[start * num_squares:end * num_squares] = NEVER
+        moves[start * num_squares:end * num_squares] = NO_MOVE
+    m_all = np.arange(num_squares, dtype=np.int64)
+    dist[exit * num_squares + m_all[m_all != exit]] = 0
+
+    # A state can only join layer + 1 if Theseus can move from its square onto a
+    # square with states in the latest layer (the frontier). Each pass looks at those
+    # squares only, skipping ones whose states are all solved already.
+    unsolved = np.full(num_squares, num_squares - 1, dtype=np.int64)
+    unsolved[exit] = 0
+    frontier = np.zeros(num_squares, dtype=bool)
+    frontier[exit] = True
+    can_move = targets >= 0
+    layer = 0
+    while True:
+        active = (frontier[np.where(can_move, targets, 0)] & can_move).any(axis=1) & (unsolved > 0)
+        squares = np.nonzero(active)[0]
+        solved = np.zeros(num_squares, dtype=np.int64)
+        for at in range(0, squares.size, chunk_squares):
+            chunk = squares[at:at + chunk_squares]
+            t = np.repeat(chunk, num_squares)
+            m = np.tile(m_all, chunk.size)
+            states_idx = t * num_squares + m
+            pending = (dist[states_idx] == NEVER) & (t != m)
+            for code in range(len(MOVE_OFFSETS)):
+                idx = np.nonzero(pending)[0]
+                target = targets[t[idx], code]
+                keep = (target >= 0) & (target != m[idx])
+                idx, target = idx[keep], target[keep]
+                if layer == 0:
+                    # Stepping onto the exit is always allowed
+                    idx = idx[target == exit]
                 else:
-                    round_num -= 1
-                    # Reset Minotaur's and Theseus' position to where they were before
-                    m_pos.set(m_row, m_col)
-                    t_pos.set(t_row, t_col)
-                    E.add_constraint((t_pos & m_pos & hedges) >> ~t_new_pos)
-                    moves.remove(move)
-                    if moves:
-                        move = moves[0]
+                    row_off = target // size - m[idx] // size + 2
+                    col_off = target % size - m[idx] % size + 2
+                    near = (row_off >= 0) & (row_off < 5) & (col_off >= 0) & (col_off < 5)
+                    threatened = near & window[m[idx], np.clip(row_off * 5 + col_off, 0, 24)]
+                    keep = (target != exit) & ~threatened
+                    idx, target = idx[keep], target[keep]
+                    m_next = minotaur_step(minotaur_step(m[idx], target), target)
+                    keep = m_next != target
+                    idx, target, m_next = idx[keep], target[keep], m_next[keep]
+                    # States finished in this pass have layer + 1, so they never match
+                    idx = idx[dist[target * num_squares + m_next] == layer]
+                if idx.size:
+                    # Moves are tried in order, so each state keeps its first best move
+                    pending[idx] = False
+                    states = states_idx[idx]
+                    dist[states] = layer + 1
+                    moves[states] = code
+                    solved += np.bincount(t[idx], minlength=num_squares)
+        if not solved.any():
+            break
+        unsolved -= solved
+        frontier = solved > 0
+        layer += 1
+    moves.flush()
+    dist.flush()
+    del moves, dist
+    return map_strategy_table(path)
+
+
+class EditableMaze:
+    def __init__(self, vert_h, hor_h, exit_x, exit_y):
+        '''
+        A maze that is solved once for every (Theseus, Minotaur) state and then kept
+        up to date as hedges are toggled, for editors that want solvability feedback
+        on every change. Same results as solve_all_states() on the edited maze.
+        @params: vert_h, hor_h (2D arrays of booleans)  starting hedges (copied)
+        @params: exit_x, exit_y (ints)                 exit square
+        '''
+        self.vert = [list(row) for row in vert_h]
+        self.hor = [list(row) for row in hor_h]
+        self.board = start_board(-1, -1, -1, -1, exit_x, exit_y, self.vert, self.hor)
+        self.space = StateSpace(self.board, exit_x, exit_y)
+        num_squares = self.space.num_squares
+        # Move code for each difference between Theseus' new and old square
+        size = self.space.size
+        self.move_codes = {row_step * size + col_step: code
+                           for code, (row_step, col_step) in enumerate(MOVE_OFFSETS)}
+        num_states = num_squares * num_squares
+        # Moves out of each state as (next state, move code); the next state is -1
+        # for the move onto the exit
+        self.succ = [[] for state in range(num_states)]
+        # States each state can be reached from
+        self.preds = [set() for state in range(num_states)]
+        self.dist = [NEVER] * num_states
+        self.moves = [NO_MOVE] * num_states
+        # State each state's best move leads to (-1 for the exit or no move)
+        self.best = [-1] * num_states
+        for state in range(num_states):
+            self.set_succ(state, self.state_succ(state))
+            t, m = divmod(state, num_squares)
+            if t == self.space.exit and t != m:
+                self.dist[state] = 0
+        self.settle(range(num_states))
+
+    def state_succ(self, state):
+        '''
+        @param: state (int)  t * num_squares + m
+        @return: list of (next state, move code) for the state, as the current hedges allow
+        '''
+        space = self.space
+        t, m = divmod(state, space.num_squares)
+        if t == m or t == space.exit:
+            return []
+        succ = []
+        for move in space.theseus_moves(t, m):
+            code = self.move_codes[move - t]
+            if move == space.exit:
+                succ.append((-1, code))
+                continue
+            m_next = space.minotaur_turn(m, move)
+            if move != m_next:
+                succ.append((move * space.num_squares + m_next, code))
+        return succ
+
+    def set_succ(self, state, succ):
+        '''
+        Replaces a state's moves, keeping preds in step.
+        '''
+        for v, code in self.succ[state]:
+            if v >= 0:
+                self.preds[v].discard(state)
+        for v, code in succ:
+            if v >= 0:
+                self.preds[v].add(state)
+        self.succ[state] = succ
+
+    def settle(self, stale):
+        '''
+        Recomputes the distances of the given states from their moves, then passes
+        any improvements back to the states that lead to them (Dijkstra's algorithm
+        with every move costing one round). States that aren't stale must still have
+        distances their moves can achieve.
+        @param: stale (iterable of ints)  states whose distances are no longer trusted
+        '''
+        dist, moves, best = self.dist, self.moves, self.best
+        stale = [state for state in stale if dist[state] != 0]
+        for state in stale:
+            dist[state], moves[state], best[state] = NEVER, NO_MOVE, -1
+        heap = []
+        for state in stale:
+            for v, code in self.succ[state]:
+                d = 1 if v < 0 else dist[v] + 1
+                if d < dist[state]:
+                    dist[state], moves[state], best[state] = d, code, v
+            if dist[state] != NEVER:
+                heap.append((dist[state], state))
+        heapq.heapify(heap)
+        while heap:
+            d, state = heapq.heappop(heap)
+            if d != dist[state]:
+                continue
+            for pred in self.preds[state]:
+                if d + 1 < dist[pred]:
+                    for v, code in self.succ[pred]:
+                        if v == state:
+                            moves[pred] = code
+                    dist[pred], best[pred] = d + 1, state
+                    heapq.heappush(heap, (d + 1, pred))
+
+    def toggle_hedge(self, kind, row, col):
+        '''
+        Adds the hedge if it's missing, removes it otherwise, and re-solves the
+        states the change can affect.
+        @param: kind (str)       'vert' for the hedge right of the square, 'hor' for the one on top
+        @params: row, col (ints) the square
+        @return: number of states whose distances were recomputed (int)
+        '''
+        space = self.space
+        size = space.size
+        if kind == 'vert':
+            self.vert[row][col] = not self.vert[row][col]
+            self.board[row][col].right = self.vert[row][col]
+            walls = [(row, col)]
+            if col + 1 < size:
+                self.board[row][col + 1].left = self.vert[row][col]
+                walls.append((row, col + 1))
+        elif kind == 'hor':
+            self.hor[row][col] = not self.hor[row][col]
+            self.board[row][col].top = self.hor[row][col]
+            walls = [(row, col)]
+            if row - 1 >= 0:
+                self.board[row - 1][col].bottom = self.hor[row][col]
+                walls.append((row - 1, col))
+        else:
+            raise ValueError("Hedge kind must be 'vert' or 'hor'")
+
+        # Only squares within 1 of the hedge see it in their tables
+        touched = set()
+        for wall_row, wall_col in walls:
+            for r in range(max(wall_row - 1, 0), min(wall_row + 2, size)):
+                for c in range(max(wall_col - 1, 0), min(wall_col + 2, size)):
+                    touched.add((r, c))
+        touched = [r * size + c for r, c in touched]
+        old_steps = {n: space.steps[n] for n in touched}
+        old_threats = {n: space.threats[n] for n in touched}
+        old_open = {n: (space.open_up[n], space.open_down[n], space.open_left[n], space.open_right[n])
+                    for n in touched}
+        for n in touched:
+            space.build_square(self.board, *divmod(n, size))
+
+        # A state's moves depend on Theseus' steps, on the squares the Minotaur
+        # threatens, and on the steps the Minotaur can take from his square and from
+        # the square his first step lands on. Only states where one of those tables
+        # changed, at a square the state actually looks at, need their moves rebuilt;
+        # all of them have the Minotaur within 1 of the hedge.
+        num_squares = space.num_squares
+        t_squares = [n for n in touched if space.steps[n] != old_steps[n]]
+        threat_changes = {n: space.threats[n] ^ old_threats[n] for n in touched
+                          if space.threats[n] != old_threats[n]}
+        opened = set(n for n in touched if (space.open_up[n], space.open_down[n], space.open_left[n],
+                                            space.open_right[n]) != old_open[n])
+        m_squares = set(threat_changes) | opened
+        for n in opened:
+            row, col = divmod(n, size)
+            for row_step, col_step in MOVE_OFFSETS:
+                if 0 <= row + row_step < size and 0 <= col + col_step < size:
+                    m_squares.add(n + row_step * size + col_step)
+        candidates = set()
+        for t in t_squares:
+            candidates.update(range(t * num_squares, (t + 1) * num_squares))
+        for m in m_squares:
+            threat_change = threat_changes.get(m, 0)
+            for t in range(num_squares):
+                steps = space.steps[t]
+                if (m in opened or any(threat_change >> move & 1 for move in steps)
+                        or any(space.minotaur_step(m, move) in opened for move in steps)):
+                    candidates.add(t * num_squares + m)
+        changed = []
+        for state in candidates:
+            succ = self.state_succ(state)
+            if succ != self.succ[state]:
+                self.set_succ(state, succ)
+                changed.append(state)
+
+        # States whose best line of play passes through a changed state may get worse;
+        # everything else keeps a distance it can still achieve
+        stale = set(changed)
+        queue = list(changed)
+        for state in queue:
+            for pred in self.preds[state]:
+                if self.best[pred] == state and pred not in stale:
+                    stale.add(pred)
+                    queue.append(pred)
+        self.settle(stale)
+        return len(stale)
+
+    def state(self, t_row, t_col, m_row, m_col):
+        '''
+        @params: t_row, t_col, m_row, m_col (ints)  Theseus' and the Minotaur's squares
+        @return: state number (int), t * num_squares + m
+        '''
+        size = self.space.size
+        return (t_row * size + t_col) * self.space.num_squares + m_row * size + m_col
+
+    def min_rounds(self, t_row, t_col, m_row, m_col):
+        '''
+        @params: t_row, t_col, m_row, m_col (ints)  Theseus' and the Minotaur's squares
+        @return: fewest rounds Theseus needs to escape (int), or None if he can't
+        '''
+        rounds = self.dist[self.state(t_row, t_col, m_row, m_col)]
+        return None if rounds == NEVER else rounds
+
+    def hint(self, t_row, t_col, m_row, m_col):
+        '''
+        Same as StrategyTable.hint(), for the maze as it is now.
+        '''
+        state = self.state(t_row, t_col, m_row, m_col)
+        if self.dist[state] == NEVER:
+            return None
+        if self.moves[state] == NO_MOVE:
+            return t_row, t_col, self.dist[state]
+        row_step, col_step = MOVE_OFFSETS[self.moves[state]]
+        return t_row + row_step, t_col + col_step, self.dist[state]
+
+
+# Search run by each worker process of parallel_winnable()
+WORKER_SEARCH = None
+
+def init_worker(space, cancel):
+    '''
+    Pool initializer: gives the worker its own search over the shared maze.
+    '''
+    global WORKER_SEARCH
+    WORKER_SEARCH = EscapeSearch(space, cancel)
+
+def search_subtree(subproblem):
+    '''
+    Pool task: searches one (t, m, rounds) subtree handed out by parallel_winnable().
+    '''
+    return WORKER_SEARCH.winnable(*subproblem)
+
+def parallel_winnable(space, t, m, rounds, workers=None, split_depth=2):
+    '''
+    Determines whether Theseus can escape by splitting the top split_depth levels
+    of his moves across worker processes. The workers share a cancel flag, so they
+    all stop as soon as one of them finds an escape. Theseus can't escape only if
+    none of the subtrees has one.
+    @param: space (StateSpace object)  maze to search
+    @param: t, m (ints)                Theseus' and the Minotaur's starting squares
+    @param: rounds (int)               number of rounds Theseus has
+    @param: workers (int or None)      number of processes (defaults to the CPU count)
+    @param: split_depth (int)          levels of moves to expand before handing out work
+    @return: boolean (True if Theseus can win, False otherwise)
+    '''
+    # Expand the top of the tree here, with the same base cases as EscapeSearch.
+    # An escape found on the way settles it without starting any workers.
+    frontier = [(t, m, rounds)]
+    for depth in range(split_depth):
+        next_frontier = []
+        for t_sq, m_sq, rounds_left in frontier:
+            if t_sq == m_sq:
+                continue
+            if t_sq == space.exit:
+                return True
+            if rounds_left <= 0:
+                continue
+            moves = space.theseus_moves(t_sq, m_sq)
+            if space.exit in moves:
+                return True
+            for move in moves:
+                next_frontier.append((move, space.minotaur_turn(m_sq, move), rounds_left - 1))
+        # Different move orders often lead to the same state, so only search it once
+        frontier = list(dict.fromkeys(next_frontier))
+    if not frontier:
+        return False
+
+    cancel = multiprocessing.Event()
+    pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(space, cancel))
+    try:
+        for result in pool.imap_unordered(search_subtree, frontier):
+            if result:
+                cancel.set()
+                return True
+        return False
+    finally:
+        pool.close()
+        pool.join()
+
+
+def sample_layout(seed, num_hedges, index):
+    '''
+    The index-th random hedge layout with exactly num_hedges hedges for a seed, so
+    the same layouts come out however the work is split up.
+    @params: seed, num_hedges, index (ints)
+    @return: (vert_h, hor_h) like Hedges.set_hedges()
+    '''
+    rng = random.Random('%d:%d:%d' % (seed, num_hedges, index))
+    vert_h, hor_h = Hedges.hedge_grid(), Hedges.hedge_grid()
+    for kind, x, y in rng.sample(hedge_segments(), num_hedges):
+        (vert_h if kind == 'vert' else hor_h)[x][y] = True
+    return vert_h, hor_h
+
+def mine_layout(task):
+    '''
+    Pool task for mine_hardest(): solves every start of one layout for every exit.
+    @param: task ((seed, num_hedges, index) tuple)
+    @return: (num_hedges, index, best) where best is (moves, Theseus' square,
+    the Minotaur's square, exit square) for the longest escape, or None if
+    Theseus can't escape from any start
+    '''
+    seed, num_hedges, index = task
+    vert_h, hor_h = sample_layout(seed, num_hedges, index)
+    space = StateSpace(start_board(-1, -1, -1, -1, -1, -1, vert_h, hor_h), 0, 0)
+    num_squares = space.num_squares
+    best = None
+    for exit in range(num_squares):
+        # The move tables don't depend on the exit, so the same space serves every exit
+        space.exit = exit
+        space.exit_dist = None
+        dist, moves = solve_all_states(space)
+        for state, rounds in enumerate(dist):
+            t, m = divmod(state, num_squares)
+            if rounds in (0, NEVER) or m == exit or (best is not None and rounds <= best[0]):
+                continue
+            best = (rounds, t, m, exit)
+    return num_hedges, index, best
+
+def mine_hardest(num_layouts, hedge_counts, top_k=10, seed=0, workers=None, checkpoint=None):
+    '''
+    Finds the mazes with the longest optimal escapes for each hedge count. Samples
+    num_layouts layouts per hedge count (see sample_layout()), solves every start
+    and exit of each across worker processes, and keeps the top_k layouts per
+    hedge count in a heap. With a checkpoint file, progress is saved every
+    MINER_CHECKPOINT_INTERVAL layouts and a rerun with the same seed, hedge counts
+    and top_k carries on from it (num_layouts can be raised to mine further).
+    @param: num_layouts (int)             layouts to try per hedge count
+    @param: hedge_counts (list of ints)   hedge counts to mine
+    @param: top_k (int)                   mazes to keep per hedge count
+    @param: seed (int)                    seed for sample_layout()
+    @param: workers (int or None)         number of processes (defaults to the CPU count)
+    @param: checkpoint (str or None)      JSON file to save progress to and resume from
+    @return: {hedge count: list of dicts, longest escape first}, each with the
+    escape's length ('moves'), the layout's 'index', 'vert' and 'hor' hedges, and
+    'theseus', 'minotaur' and 'exit' squares as [row, col]
+    '''
+    hedge_counts = list(hedge_counts)
+    settings = {'seed': seed, 'hedge_counts': hedge_counts, 'top_k': top_k}
+    # Heap entries are (moves, -index, num_hedges, entry): the smallest is dropped first
+    heaps = {num_hedges: [] for num_hedges in hedge_counts}
+    done = 0
+    if checkpoint is not None and os.path.isfile(checkpoint):
+        with open(checkpoint) as f:
+            saved = json.load(f)
+        if saved['settings'] != settings:
+            raise ValueError("Checkpoint %s was made with different settings: %r"
+                             % (checkpoint, saved['settings']))
+        done = saved['done']
+        for num_hedges, entries in saved['top'].items():
+            heaps[int(num_hedges)] = [(entry['moves'], -entry['index'], int(num_hedges), entry)
+                                      for entry in entries]
+            heapq.heapify(heaps[int(num_hedges)])
+
+    def save():
+        top = {num_hedges: [item[3] for item in sorted(heap, key=lambda item: item[:2], reverse=True)]
+               for num_hedges, heap in heaps.items()}
+        # Write to a temporary file first so a crash never leaves half a checkpoint
+        with open(checkpoint + '.tmp', 'w') as f:
+            json.dump({'settings': settings, 'done': done, 'top': top}, f)
+        os.replace(checkpoint + '.tmp', checkpoint)
+
+    tasks = [(seed, num_hedges, index) for index in range(num_layouts) for num_hedges in hedge_counts]
+    pool = multiprocessing.Pool(workers)
+    try:
+        # Results come back in order, so everything before done is finished
+        for num_hedges, index, best in pool.imap(mine_layout, tasks[done:], chunksize=4):
+            done += 1
+            if best is not None:
+                moves, t, m, exit = best
+                vert_h, hor_h = sample_layout(seed, num_hedges, index)
+                entry = {'moves': moves, 'index': index, 'vert': vert_h, 'hor': hor_h,
+                         'theseus': list(divmod(t, BOARD_SIZE)), 'minotaur': list(divmod(m, BOARD_SIZE)),
+                         'exit': list(divmod(exit, BOARD_SIZE))}
+                item = (moves, -index, num_hedges, entry)
+                if len(heaps[num_hedges]) < top_k:
+                    heapq.heappush(heaps[num_hedges], item)
+                elif item[:2] > heaps[num_hedges][0][:2]:
+                    heapq.heapreplace(heaps[num_hedges], item)
+            if checkpoint is not None and done % MINER_CHECKPOINT_INTERVAL == 0:
+                save()
+    finally:
+        pool.close()
+        pool.join()
+    if checkpoint is not None:
+        save()
+    return {num_hedges: [item[3] for item in sorted(heap, key=lambda item: item[:2], reverse=True)]
+            for num_hedges, heap in heaps.items()}
+
+
+def generate_mazes(n, num_hedges, seed=None):
+    '''
+    Generates n random mazes at once with NumPy. Unlike Hedges.set_hedges(), every
+    maze gets exactly num_hedges distinct hedges, all of them between two squares
+    (never on the outer wall), and Theseus, the Minotaur and the exit start on
+    three different squares. The output uses the same conventions as Hedges, so
+    start_board(..., vert[i], hor[i]) works on any one of them.
+    @param: n (int)                            number of mazes
+    @param: num_hedges (int or array of ints)  hedges per maze (one count for all, or one per maze)
+    @param: seed (int or None)                 seed for NumPy's random generator
+    @return: vert, hor (n x BOARD_SIZE x BOARD_SIZE bool arrays) hedges to the right
+    of / on top of each square, and thes, mino, exit (n x 2 int arrays) row, col of
+    Theseus' and the Minotaur's starting squares and of the exit
+    '''
+    if np is None:
+        raise ImportError("generate_mazes() needs NumPy")
+    size = BOARD_SIZE
+    num_vert = size * (size - 1)
+    num_slots = 2 * num_vert
+    need = np.array(np.broadcast_to(num_hedges, (n,)), dtype=np.int16)
+    if need.min(initial=0) < 0 or need.max(initial=0) > num_slots:
+        raise ValueError("num_hedges must be between 0 and %d" % num_slots)
+    rng = np.random.default_rng(seed)
+
+    # Go through the possible hedges once, taking each one with probability
+    # (hedges still needed) / (hedges left to look at). This always picks exactly
+    # the number asked for, with every set of hedges equally likely, and costs
+    # one vectorized draw per possible hedge rather than one per maze.
+    picked = np.empty((num_slots, n), dtype=bool)
+    for slot in range(num_slots):
+        take = rng.random(n, dtype=np.float32) * (num_slots - slot) < need
+        picked[slot] = take
+        need -= take
+    vert = np.zeros((n, size, size), dtype=bool)
+    hor = np.zeros((n, size, size), dtype=bool)
+    # The first num_vert slots are hedges right of squares not in the last column,
+    # the rest are hedges on top of squares not in the first row
+    vert[:, :, :size - 1] = picked[:num_vert].T.reshape(n, size, size - 1)
+    hor[:, 1:, :] = picked[num_vert:].T.reshape(n, size - 1, size)
+
+    # Three distinct squares: draw from fewer squares each time and skip over the
+    # ones already taken
+    num_squares = size * size
+    thes = rng.integers(0, num_squares, n)
+    mino = rng.integers(0, num_squares - 1, n)
+    mino += mino >= thes
+    low = np.minimum(thes, mino)
+    high = np.maximum(thes, mino)
+    exit = rng.integers(0, num_squares - 2, n)
+    exit += exit >= low
+    exit += exit >= high
+    return (vert, hor, np.stack(np.divmod(thes, size), axis=1),
+            np.stack(np.divmod(mino, size), axis=1), np.stack(np.divmod(exit, size), axis=1))
+
+
+# Square of the board used by explore_hedges(): reading one of its sides asks
+# the HedgeProbe whether that hedge segment is there
+class ProbeSquare:
+    __slots__ = ('probe', 'x', 'y')
+
+    def __init__(self, probe, x, y):
+        self.probe = probe
+        self.x = x
+        self.y = y
+
+    @property
+    def top(self):
+        return self.probe.value(hedge_segment('hor', self.x, self.y))
+
+    @property
+    def bottom(self):
+        return self.probe.value(hedge_segment('hor', self.x + 1, self.y))
+
+    @property
+    def right(self):
+        return self.probe.value(hedge_segment('vert', self.x, self.y))
+
+    @property
+    def left(self):
+        return self.probe.value(hedge_segment('vert', self.x, self.y - 1))
+
+
+class HedgeProbe:
+    def __init__(self, fixed):
+        '''
+        A board whose hedges are decided as they're read. Segments in fixed get
+        the given value; any other segment is taken to have no hedge.
+        @param: fixed (dict)  HedgeSegment -> whether it has a hedge
+        '''
+        self.fixed = fixed
+        # Every segment read so far and its value, and the ones that weren't fixed
+        self.read = {}
+        self.new = []
+        self.board = [[ProbeSquare(self, x, y) for y in range(BOARD_SIZE)]
+                      for x in range(BOARD_SIZE)]
+
+    def value(self, segment):
+        if segment is None:
+            return False
+        if segment not in self.read:
+            if segment in self.fixed:
+                self.read[segment] = self.fixed[segment]
+            else:
+                self.read[segment] = False
+                self.new.append(segment)
+        return self.read[segment]
+
+
+def explore_hedges(func):
+    '''
+    Finds out exactly which hedge segments func's answer depends on by running it on
+    probe boards. Each run takes unread segments to have no hedge; every segment
+    first read that way is then tried again with a hedge, so the runs cover every
+    case func can tell apart.
+    @param: func (function of a board)  must only look at the board's hedges
+    @return: list of (conditions, answer) pairs, where conditions maps HedgeSegment
+    propositions to whether they have a hedge. Any layout meets exactly one of them.
+    '''
+    leaves = []
+    pending = [{}]
+    while pending:
+        fixed = pending.pop()
+        probe = HedgeProbe(fixed)
+        answer = func(probe.board)
+        leaves.append((probe.read, answer))
+        for i, segment in enumerate(probe.new):
+            branch = dict(fixed)
+            for earlier in probe.new[:i]:
+                branch[earlier] = False
+            branch[segment] = True
+            pending.append(branch)
+    return leaves
+
+
+class MazeSynthesis:
+    def __init__(self, t_start, m_start, exit, num_moves):
+        '''
+        CNF encoding of "Theseus needs exactly num_moves rounds to escape" with one
+        variable per HedgeSegment proposition (self.segments maps each to its DIMACS
+        number, 1 to len(hedge_segments()) in segment_index() order). The game's rules come from explore_hedges() on
+        MinoMoves, so they match the search exactly. Auxiliary variables:
+        - threat (m, square): the Minotaur on m can reach square in his turn
+        - turn (m, t, m2): with Theseus on t, the Minotaur on m ends his turn on m2
+        - reach (j, t, m): true for every state Theseus can be in after j rounds;
+          none of them before round num_moves - 1 may have the exit one safe step away
+        - path (j, t, m), take (j, t, m, move): a line of play escaping in num_moves rounds
+        Squares are numbered row * BOARD_SIZE + col.
+        @param: t_start, m_start, exit ((row, col) tuples)  Theseus, the Minotaur and the exit
+        @param: num_moves (int)                             rounds Theseus should need
+        '''
+        size = BOARD_SIZE
+        self.t_start = t_start[0] * size + t_start[1]
+        self.m_start = m_start[0] * size + m_start[1]
+        self.exit = exit[0] * size + exit[1]
+        self.num_moves = num_moves
+        self.segments = {HedgeSegment(kind, x, y): n
+                         for n, (kind, x, y) in enumerate(hedge_segments(), start=1)}
+        self.num_vars = len(self.segments)
+        self.vars = {}
+        self.clauses = []
+        self.threats = {}
+        self.turns = {}
+
+    def var(self, key):
+        '''
+        @param: key (tuple)  name of an auxiliary variable
+        @return: its number (int), allocated the first time it's asked for
+        '''
+        if key not in self.vars:
+            self.num_vars += 1
+            self.vars[key] = self.num_vars
+        return self.vars[key]
+
+    def add_leaves(self, leaves, literal):
+        '''
+        Adds "conditions imply literal(answer)" for each pair from explore_hedges().
+        '''
+        for conditions, answer in leaves:
+            lit = literal(answer)
+            if lit is not None:
+                self.clauses.append([-self.segments[segment] if hedge else self.segments[segment]
+                                     for segment, hedge in conditions.items()] + [lit])
+
+    def threat(self, m, square):
+        '''
+        @param: m, square (ints)  the Minotaur's square and Theseus' target
+        @return: variable true when the Minotaur threatens square, or None if he never can
+        '''
+        if (m, square) not in self.threats:
+            m_row, m_col = divmod(m, BOARD_SIZE)
+            row, col = divmod(square, BOARD_SIZE)
+            var = None
+            if ThesMoves.mino_within_range(row, col, m_row, m_col):
+                var = self.var(('threat', m, square))
+                self.add_leaves(explore_hedges(
+                    lambda board: MinoMoves.mino_hedges_in_way(board, row, col, m_row, m_col)),
+                    lambda blocked: -var if blocked else var)
+            self.threats[m, square] = var
+        return self.threats[m, square]
+
+    def turn(self, m, t):
+        '''
+        @param: m, t (ints)  the Minotaur's and Theseus' squares
+        @return: {square: variable} for where the Minotaur can end his turn; exactly
+        one of the variables is true
+        '''
+        if (m, t) not in self.turns:
+            m_row, m_col = divmod(m, BOARD_SIZE)
+            t_row, t_col = divmod(t, BOARD_SIZE)
+
+            def mino_turn(board):
+                row, col = MinoMoves.mino_step(board, m_row, m_col, t_row, t_col)
+                row, col = MinoMoves.mino_step(board, row, col, t_row, t_col)
+                return row * BOARD_SIZE + col
+
+            leaves = explore_hedges(mino_turn)
+            ends = {}
+            for conditions, end in leaves:
+                ends[end] = self.var(('turn', m, t, end))
+            self.add_leaves(leaves, lambda end: ends[end])
+            ends_list = list(ends.values())
+            for i, a in enumerate(ends_list):
+                for b in ends_list[i + 1:]:
+                    self.clauses.append([-a, -b])
+            self.turns[m, t] = ends
+        return self.turns[m, t]
+
+    def moves(self, t, m):
+        '''
+        Theseus' moves from t that don't walk into the Minotaur, ignoring hedges.
+        @return: list of (move code, target square, hedge variable or None for staying)
+        '''
+        row, col = divmod(t, BOARD_SIZE)
+        moves = []
+        for code, (row_step, col_step) in enumerate(MOVE_OFFSETS):
+            targ_row, targ_col = row + row_step, col + col_step
+            if not (0 <= targ_row < BOARD_SIZE and 0 <= targ_col < BOARD_SIZE):
+                continue
+            target = targ_row * BOARD_SIZE + targ_col
+            if target == m:
+                continue
+            if row_step == -1:
+                segment = hedge_segment('hor', row, col)
+            elif row_step == 1:
+                segment = hedge_segment('hor', row + 1, col)
+            elif col_step == 1:
+                segment = hedge_segment('vert', row, col)
+            elif col_step == -1:
+                segment = hedge_segment('vert', row, col - 1)
+            else:
+                segment = None
+            moves.append((code, target, None if segment is None else self.segments[segment]))
+        return moves
+
+    def build(self):
+        '''
+        Adds all the clauses.
+        '''
+        k = self.num_moves
+        exit = self.exit
+        # Not fewer: every state reachable after j < k - 1 rounds is forced to be
+        # marked, and a marked state must not have the exit one open step away
+        layer = {(self.t_start, self.m_start)}
+        self.clauses.append([self.var(('reach', 0, self.t_start, self.m_start))])
+        for j in range(k - 1):
+            next_layer = set()
+            for t, m in layer:
+                reach = self.var(('reach', j, t, m))
+                for code, target, hedge in self.moves(t, m):
+                    if target == exit:
+                        self.clauses.append([-reach, hedge])
+                        continue
+                    if j == k - 2:
+                        continue
+                    # Blocked or threatened moves don't count; otherwise the new state is reached
+                    blockers = [lit for lit in (hedge, self.threat(m, target)) if lit is not None]
+                    for end, turn in self.turn(m, target).items():
+                        if end != target:
+                            next_layer.add((target, end))
+                            self.clauses.append([-reach, -turn, self.var(('reach', j + 1, target, end))]
+                                                + blockers)
+            layer = next_layer
+
+        # Exactly: a line of play that takes an open, unthreatened move each round
+        # and steps onto the exit in round k
+        layer = {(self.t_start, self.m_start)}
+        self.clauses.append([self.var(('path', 0, self.t_start, self.m_start))])
+        exit_row, exit_col = divmod(exit, BOARD_SIZE)
+        for j in range(k):
+            next_layer = set()
+            for t, m in layer:
+                path = self.var(('path', j, t, m))
+                if j == k - 1:
+                    hedges = [hedge for code, target, hedge in self.moves(t, m) if target == exit]
+                    self.clauses.append([-path, -hedges[0]] if hedges else [-path])
+                    continue
+                takes = []
+                for code, target, hedge in self.moves(t, m):
+                    row, col = divmod(target, BOARD_SIZE)
+                    # Skip moves that leave Theseus too far from the exit to make it in time
+                    if target == exit or abs(row - exit_row) + abs(col - exit_col) > k - j - 1:
+                        continue
+                    take = self.var(('take', j, t, m, code))
+                    takes.append(take)
+                    for lit in (hedge, self.threat(m, target)):
+                        if lit is not None:
+                            self.clauses.append([-take, -lit])
+                    for end, turn in self.turn(m, target).items():
+                        if end == target:
+                            self.clauses.append([-take, -turn])
+                        else:
+                            next_layer.add((target, end))
+                            self.clauses.append([-take, -turn, self.var(('path', j + 1, target, end))])
+                self.clauses.append([-path] + takes)
+            layer = next_layer
+
+    def write(self, path):
+        '''
+        Writes the clauses to a DIMACS CNF file, naming the HedgeSegment variables
+        in its comments.
+        @param: path (str)  file to write
+        '''
+        with open(path, 'w') as f:
+            for segment, n in self.segments.items():
+                f.write('c %d HedgeSegment(%r, %d, %d)\n' % ((n,) + segment.get()))
+            f.write('p cnf %d %d\n' % (self.num_vars, len(self.clauses)))
+            for clause in self.clauses:
+                f.write(' '.join(map(str, clause)) + ' 0\n')
+
+
+def synthesize_maze(t_start, m_start, exit, num_moves, path=None):
+    '''
+    Asks kissat for a hedge layout in which Theseus, starting at t_start with the
+    Minotaur at m_start, can escape through exit in exactly num_moves rounds and
+    no fewer. Replaces generating random mazes until one is hard enough.
+    @param: t_start, m_start, exit ((row, col) tuples)  three different squares
+    @param: num_moves (int)                             rounds Theseus should need (at least 1)
+    @param: path (str or None)                          where to keep the CNF file
+                                                        (a temporary file if None)
+    @return: (vert_h, hor_h) like Hedges.set_hedges(), or None if no layout works
+    '''
+    t_start, m_start, exit = tuple(t_start), tuple(m_start), tuple(exit)
+    if len({t_start, m_start, exit}) < 3:
+        raise ValueError("Theseus, the Minotaur and the exit need different squares")
+    if num_moves < 1:
+        raise ValueError("num_moves must be at least 1")
+    # The fewest rounds never repeat a state, so no layout needs as many rounds as
+    # there are states; don't build an encoding that size just to find that out
+    if num_moves >= (BOARD_SIZE * BOARD_SIZE) ** 2:
+        return None
+    synthesis = MazeSynthesis(t_start, m_start, exit, num_moves)
+    synthesis.build()
+    if path is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cnf_path = os.path.join(tmp_dir, 'synthesis.cnf')
+            synthesis.write(cnf_path)
+            model = dimacs_model(cnf_path)
+    else:
+        synthesis.write(path)
+        model = dimacs_model(path)
+    if model is None:
+        return None
+
+    vert_h, hor_h = Hedges.hedge_grid(), Hedges.hedge_grid()
+    for segment, n in synthesis.segments.items():
+        if n in model:
+            kind, x, y = segment.get()
+            (vert_h if kind == 'vert' else hor_h)[x][y] = True
+    # Check the layout against the search, which plays by the game's rules directly
+    board = start_board(t_start[0], t_start[1], m_start[0], m_start[1], exit[0], exit[1], vert_h, hor_h)
+    space = StateSpace(board, exit[0], exit[1])
+    found = min_rounds(space, space.square(*t_start), space.square(*m_start))
+    if found != num_moves:
+        raise RuntimeError("Synthesized maze needs %r rounds, not %d" % (found, num_moves))
+    return vert_h, hor_h
+
+
+# Number of puzzles each tier of prefilter() has decided
+PREFILTER_DECIDED = {tier: 0 for tier in PREFILTER_TIERS}
+
+def open_steps(board, row, col):
+    '''
+    @param: board (2D array of Board_Square objects)  board to take the hedges from
+    @params: row, col (ints)                          the square
+    @return: list of (row, col) squares one step away with no hedge in between
+    '''
+    square = board[row][col]
+    size = len(board)
+    steps = []
+    if row - 1 >= 0 and not square.top:
+        steps.append((row - 1, col))
+    if row + 1 < size and not square.bottom:
+        steps.append((row + 1, col))
+    if col + 1 < size and not square.right:
+        steps.append((row, col + 1))
+    if col - 1 >= 0 and not square.left:
+        steps.append((row, col - 1))
+    return steps
+
+def find_root(parent, n):
+    '''
+    Union-find lookup with path halving.
+    @param: parent (list of ints)  parent of each element
+    @param: n (int)                element
+    @return: root of n's set (int)
+    '''
+    while parent[n] != n:
+        parent[n] = parent[parent[n]]
+        n = parent[n]
+    return n
+
+def connected(board, start, goal):
+    '''
+    Whether the hedges leave any path between two squares, by joining the squares
+    on either side of every missing hedge.
+    @param: board (2D array of Board_Square objects)  board to take the hedges from
+    @param: start, goal ((row, col) tuples)           the squares
+    @return: boolean
+    '''
+    size = len(board)
+    parent = list(range(size * size))
+    for row in range(size):
+        for col in range(size):
+            n = row * size + col
+            # Hedges block both ways, so looking right and down covers every gap
+            if col + 1 < size and not board[row][col].right:
+                parent[find_root(parent, n)] = find_root(parent, n + 1)
+            if row + 1 < size and not board[row][col].bottom:
+                parent[find_root(parent, n)] = find_root(parent, n + size)
+    return (find_root(parent, start[0] * size + start[1])
+            == find_root(parent, goal[0] * size + goal[1]))
+
+def maze_distance(board, start, goal, limit):
+    '''
+    Hedge-aware number of steps between two squares, ignoring the Minotaur.
+    @param: board (2D array of Board_Square objects)  board to take the hedges from
+    @param: start, goal ((row, col) tuples)           the squares
+    @param: limit (int)                               stop looking past this many steps
+    @return: number of steps (int), or None if it's more than limit
+    '''
+    if start == goal:
+        return 0
+    seen = {start}
+    layer = [start]
+    for steps in range(1, limit + 1):
+        next_layer = []
+        for row, col in layer:
+            for step in open_steps(board, row, col):
+                if step == goal:
+                    return steps
+                if step not in seen:
+                    seen.add(step)
+                    next_layer.append(step)
+        layer = next_layer
+    return None
+
+def prefilter(board, t_start, m_start, exit, rounds):
+    '''
+    Cheap checks that decide many puzzles without is_winnable() or the SAT solver,
+    tried in the order of PREFILTER_TIERS:
+    1) immediate: Theseus starts on the Minotaur (eaten) or on the exit (escaped),
+       or has no rounds at all.
+    2) connectivity: the hedges wall the exit off from Theseus.
+    3) distance: the exit is more steps away than Theseus has rounds.
+    4) first move: every square Theseus could step to gets him caught, or he can
+       step straight onto the exit.
+    Whichever tier decides the puzzle is counted in PREFILTER_DECIDED.
+    @param: board (2D array of Board_Square objects)  starting board
+    @param: t_start, m_start, exit ((row, col) tuples)  Theseus, the Minotaur and the exit
+    @param: rounds (int)                              number of rounds Theseus has
+    @return: (tier, winnable) - the deciding tier and whether Theseus can escape,
+    or (None, None) if the puzzle needs a full solve
+    '''
+    tier, winnable = None, None
+    if t_start == m_start:
+        tier, winnable = 'immediate', False
+    elif t_start == exit:
+        tier, winnable = 'immediate', True
+    elif rounds <= 0:
+        tier, winnable = 'immediate', False
+    elif not connected(board, t_start, exit):
+        tier, winnable = 'connectivity', False
+    elif maze_distance(board, t_start, exit, rounds) is None:
+        tier, winnable = 'distance', False
+    else:
+        size = len(board)
+        threats = MinoMoves.threat_mask(board, m_start[0], m_start[1])
+        # Same rule as StateSpace.theseus_moves(), staying put included
+        moves = []
+        for step in open_steps(board, t_start[0], t_start[1]) + [t_start]:
+            threatened = threats >> (step[0] * size + step[1]) & 1
+            if step != m_start and (step == exit or not threatened):
+                moves.append(step)
+        if not moves:
+            tier, winnable = 'first move', False
+        elif exit in moves:
+            tier, winnable = 'first move', True
+    if tier is not None:
+        PREFILTER_DECIDED[tier] += 1
+    return tier, winnable
 
 
 def example_theory_1():
@@ -673,7 +2830,7 @@ def example_theory_1():
     A full example theory for our model. Hedges and number of rounds are randomized,
     but starting Theseus and Minotaur and immutable Exit positions are not. As such,
     Theseus is expected to win most rounds, but the placement of hedges may prevent
-    him from winning. To run this theory, uncomment NUM_ROUNDS = 3 on line 24.
+    him from winning. To run this theory, uncomment NUM_ROUNDS = 3 on line 85.
     See game() for a truly randomized run.
     No args.
     '''
@@ -753,8 +2910,8 @@ def example_theory_1():
         print("Theseus escapes!")
     else:
         print("Theseus got eaten by the Minotaur :(")
-    T = E.compile()
-    print("Satisfiable: %s" % T.satisfiable())
+    key = puzzle_hash(hedges.vert, hedges.hor, (t_x, t_y), (m_x, m_y), (exit_x, exit_y), NUM_ROUNDS)
+    print("Satisfiable: %s" % theory_satisfiable(key))
     print()
 
 
@@ -763,7 +2920,7 @@ def example_theory_2():
     A second full example theory for our model. Similar to first one, but here
     Theseus is expect to lose most runs except if he has fortunately-placed hedges.
     This will likely take longer to run than example_theory_1. To run this theory,
-    uncomment NUM_ROUNDS = 8 on line 27.
+    uncomment NUM_ROUNDS = 8 on line 88.
     See game() for a truly randomized run.
     No args.
     '''
@@ -843,18 +3000,36 @@ def example_theory_2():
         print("Theseus escapes!")
     else:
         print("Theseus got eaten by the Minotaur :(")
-    T = E.compile()
-    print("Satisfiable: %s" % T.satisfiable())
+    key = puzzle_hash(hedges.vert, hedges.hor, (t_x, t_y), (m_x, m_y), (exit_x, exit_y), NUM_ROUNDS)
+    print("Satisfiable: %s" % theory_satisfiable(key))
     print()
 
 
+# Hedges for example_theory_3 (also used by bench.py)
+EXAMPLE_3_VERT_H = [
+                   [False, False, True, False, False, False],
+                   [True, True, True, False, False, False],
+                   [True, False, False, False, True, True],
+                   [True, True, False, True, True, True],
+                   [True, False, False, False, False, True],
+                   [False, True, True, True, False, False]
+                   ]
+EXAMPLE_3_HOR_H = [
+                  [True, False, False, False, False, False],
+                  [False, False, False, False, False, True],
+                  [False, False, False, False, False, False],
+                  [True, True, False, True, True, True],
+                  [True, True, False, True, False, False],
+                  [False, False, True, False, True, False]
+                  ]
+
 def example_theory_3():
     '''
     Showcases an interesting configuration of the maze, with Theseus being farther
     from the exit than the Minotaur, but hedges preventing the Minotaur from making
     any effective moves. Originally derived from a run of example_theory_2.
     This requires at least eight moves to work - to ensure this runs properly,
-    uncomment NUM_ROUNDS = 14 on line 30.
+    uncomment NUM_ROUNDS = 14 on line 91.
     No args.
     '''
     # Set starting positions, exit, and hedges
@@ -868,22 +3043,8 @@ def example_theory_3():
     m_start = MinoPos(m_x, m_y)
     constraint.add_exactly_one(E, m_start)
 
-    vert_h = [
-             [False, False, True, False, False, False],
-             [True, True, True, False, False, False],
-             [True, False, False, False, True, True],
-             [True, True, False, True, True, True],
-             [True, False, False, False, False, True],
-             [False, True, True, True, False, False]
-             ]
-    hor_h = [
-            [True, False, False, False, False, False],
-            [False, False, False, False, False, True],
-            [False, False, False, False, False, False],
-            [True, True, False, True, True, True],
-            [True, True, False, True, False, False],
-            [False, False, True, False, True, False]
-            ]
+    vert_h = EXAMPLE_3_VERT_H
+    hor_h = EXAMPLE_3_HOR_H
     hedges = Hedges()
     hedges.vert = vert_h
     hedges.hor = hor_h
@@ -947,8 +3108,8 @@ def example_theory_3():
         print("Theseus escapes!")
     else:
         print("Theseus got eaten by the Minotaur :(")
-    T = E.compile()
-    print("Satisfiable: %s" % T.satisfiable())
+    key = puzzle_hash(vert_h, hor_h, (t_x, t_y), (m_x, m_y), (e_x, e_y), NUM_ROUNDS)
+    print("Satisfiable: %s" % theory_satisfiable(key))
     print()
 
 
@@ -1027,21 +3188,29 @@ def game():
     # Number of rounds
     print("Number of rounds: ", NUM_ROUNDS)
 
-    # Play the game
-    turn_num = 0
-    if is_winnable(board, t_start, m_start, exit, hedges, turn_num):
+    # Cheap checks first; only puzzles they can't decide get the full search and SAT check
+    tier, winnable = prefilter(board, (t_x, t_y), (m_x, m_y), (e_x, e_y), NUM_ROUNDS)
+    if tier is None:
+        # Play the game
+        turn_num = 0
+        winnable = is_winnable(board, t_start, m_start, exit, hedges, turn_num)
+    if winnable:
         print("Theseus escapes!")
     else:
         print("Theseus got eaten by the Minotaur :(")
-    T = E.compile()
-    print("Satisfiable: %s" % T.satisfiable())
+    if tier is None:
+        key = puzzle_hash(hedges.vert, hedges.hor, (t_x, t_y), (m_x, m_y), (e_x, e_y), NUM_ROUNDS)
+        print("Satisfiable: %s" % theory_satisfiable(key))
+    else:
+        print("Decided by the %s check" % tier)
     print()
 
 # Only leave one of these uncommented at a time! Otherwise, you're adding
 # the propositions and constraints for the next run of the program on top of
 # the previous run. Do not leave more than one of the following uncommented
 # at a time!
-#example_theory_1()
-#example_theory_2()
-#example_theory_3()
-game()
+if __name__ == "__main__":
+    #example_theory_1()
+    #example_theory_2()
+    #example_theory_3()
+    game()
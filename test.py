@@ -1,14 +1,19 @@
 
-import os, sys
+import os, random, sys
 
-from run import example_theory
+import pytest
+
+import run
+import trace_summary
 
 USAGE = '\n\tpython3 test.py [draft|final]\n'
 EXPECTED_VAR_MIN = 10
 EXPECTED_CONS_MIN = 50
+# Seeds for the random mazes the search tests run on
+TEST_SEEDS = range(8)
 
 def test_theory():
-    T = example_theory()
+    T = run.example_theory()
 
     assert len(T.vars()) > EXPECTED_VAR_MIN, "Only %d variables -- your theory is likely not sophisticated enough for the course project." % len(T.vars())
     assert T.size() > EXPECTED_CONS_MIN, "Only %d operators in the formula -- your theory is likely not sophisticated enough for the course project." % T.size()
@@ -26,6 +31,313 @@ def file_checks(stage):
     assert modelling_report_docx or modelling_report_pptx or (report_txt and report_pdf), \
             "Missing your report (Word, PowerPoint, or OverLeaf) in your %s folder" % stage
 
+def test_interned_positions():
+    # thes_win() used to build the exit square from the board's boolean flags,
+    # which shared a cache entry with the real position (1, 1)
+    assert run.ThesPos(True, True) is run.ThesPos(1, 1)
+    assert run.ThesPos(True, True).get() == (1, 1)
+    assert all(type(coord) is int for coord in run.ThesPos(True, False).get())
+    assert run.MinoPos(0, 1) is not run.MinoPos(1, 0)
+
+def random_maze(seed, density=0.3):
+    '''
+    @param: seed (int)       seed for the maze
+    @param: density (float)  chance of each hedge being there
+    @return: vert, hor hedge grids and the exit (row, col) of a random maze
+    '''
+    rng = random.Random(seed)
+    size = run.BOARD_SIZE
+    vert = [[rng.random() < density for col in range(size)] for row in range(size)]
+    hor = [[rng.random() < density for col in range(size)] for row in range(size)]
+    return vert, hor, divmod(rng.randrange(size * size), size)
+
+def maze_space(vert, hor, exit):
+    return run.StateSpace(run.start_board(-1, -1, -1, -1, exit[0], exit[1], vert, hor), exit[0], exit[1])
+
+def test_min_rounds_matches_search():
+    for seed in TEST_SEEDS:
+        space = maze_space(*random_maze(seed))
+        rng = random.Random(seed)
+        for i in range(10):
+            t, m = rng.randrange(space.num_squares), rng.randrange(space.num_squares)
+            best = run.min_rounds(space, t, m)
+            for rounds in range(12):
+                expected = best is not None and best <= rounds
+                assert run.EscapeSearch(space).winnable(t, m, rounds) == expected, \
+                        "seed %d, t %d, m %d, %d rounds" % (seed, t, m, rounds)
+
+def test_strategy_table_round_trip(tmp_path):
+    vert, hor, exit = random_maze(0)
+    space = maze_space(vert, hor, exit)
+    path = str(tmp_path / 'maze.strategy')
+    run.save_strategy_table(space, path)
+    with open(path, 'rb') as f:
+        assert f.read() == run.strategy_table(space)
+    dist, moves = run.solve_all_states(space)
+    for table in (run.load_strategy_table(path), run.map_strategy_table(path)):
+        assert (table.size, table.exit) == (space.size, space.exit)
+        for state in range(len(dist)):
+            assert table.distance(state) == dist[state]
+
+def test_hints_are_legal_and_optimal():
+    for seed in TEST_SEEDS:
+        space = maze_space(*random_maze(seed))
+        table = run.StrategyTable(run.strategy_table(space))
+        size = space.size
+        for t in range(space.num_squares):
+            for m in range(space.num_squares):
+                hint = table.hint(t // size, t % size, m // size, m % size)
+                best = run.min_rounds(space, t, m)
+                if best is None:
+                    assert hint is None
+                    continue
+                row, col, rounds = hint
+                assert rounds == best
+                if rounds == 0:
+                    assert (row * size + col, t) == (space.exit, space.exit)
+                    continue
+                # The hinted square must be a legal move that leaves one round fewer
+                move = row * size + col
+                assert move in space.theseus_moves(t, m)
+                if move != space.exit:
+                    assert run.min_rounds(space, move, space.minotaur_turn(m, move)) == rounds - 1
+                else:
+                    assert rounds == 1
+
+def test_editable_maze_matches_full_solve():
+    for seed in TEST_SEEDS[:4]:
+        vert, hor, exit = random_maze(seed)
+        em = run.EditableMaze(vert, hor, exit[0], exit[1])
+        rng = random.Random(seed)
+        for i in range(15):
+            kind = rng.choice(['vert', 'hor'])
+            em.toggle_hedge(kind, rng.randrange(run.BOARD_SIZE), rng.randrange(run.BOARD_SIZE))
+            dist, moves = run.solve_all_states(maze_space(em.vert, em.hor, exit))
+            assert em.dist == dist, "seed %d, edit %d" % (seed, i)
+
+def test_editable_maze_toggle_is_local():
+    for seed in TEST_SEEDS[:4]:
+        vert, hor, exit = random_maze(seed)
+        em = run.EditableMaze(vert, hor, exit[0], exit[1])
+        num_states = len(em.dist)
+        checked = []
+        state_succ = em.state_succ
+        def counting_state_succ(state):
+            checked.append(state)
+            return state_succ(state)
+        em.state_succ = counting_state_succ
+        rng = random.Random(seed)
+        for i in range(15):
+            del checked[:]
+            # Interior hedges, away from the board's edges
+            kind = rng.choice(['vert', 'hor'])
+            em.toggle_hedge(kind, rng.randrange(1, run.BOARD_SIZE - 1), rng.randrange(1, run.BOARD_SIZE - 2))
+            assert len(checked) < num_states // 4, "seed %d, edit %d: %d states" % (seed, i, len(checked))
+        dist, moves = run.solve_all_states(maze_space(em.vert, em.hor, exit))
+        assert em.dist == dist
+
+def test_transposition_table_matches_dict():
+    for seed in TEST_SEEDS:
+        space = maze_space(*random_maze(seed))
+        rng = random.Random(seed)
+        for i in range(10):
+            t, m = rng.randrange(space.num_squares), rng.randrange(space.num_squares)
+            rounds = rng.randrange(12)
+            # A table this small evicts almost every entry, which must only cost time
+            table = run.TranspositionTable(4)
+            assert run.EscapeSearch(space, table=table).winnable(t, m, rounds) == \
+                    run.EscapeSearch(space).winnable(t, m, rounds)
+            assert table.stats()['capacity'] == 4
+
+def test_transposition_table_buckets():
+    for capacity in (1, 2, 5, 1000):
+        table = run.TranspositionTable(capacity)
+        assert table.num_buckets & (table.num_buckets - 1) == 0
+        assert 2 * table.num_buckets >= capacity
+        buckets = set(table.bucket(state) for state in range(1000))
+        assert all(0 <= at < len(table.slots) for at in buckets)
+        # Every bucket is used once there are plenty of states
+        assert len(buckets) == table.num_buckets
+
+def test_solve_to_file_matches_solve_all_states(tmp_path):
+    pytest.importorskip('numpy')
+    for seed in TEST_SEEDS:
+        space = maze_space(*random_maze(seed))
+        path = str(tmp_path / 'maze.strategy')
+        # Chunks of 1 and 3 Theseus squares, and the whole board at once
+        table = run.solve_to_file(space, path, chunk_states=[36, 108, 1 << 18][seed % 3])
+        dist, moves = run.solve_all_states(space)
+        assert [table.distance(state) for state in range(len(dist))] == dist
+
+def test_prefilter_agrees_with_search():
+    tiers = set()
+    for seed in range(60):
+        vert, hor, exit = random_maze(seed, density=[0.2, 0.4, 0.6][seed % 3])
+        space = maze_space(vert, hor, exit)
+        rng = random.Random(seed)
+        for i in range(20):
+            t = divmod(rng.randrange(space.num_squares), run.BOARD_SIZE)
+            m = divmod(rng.randrange(space.num_squares), run.BOARD_SIZE)
+            rounds = rng.randrange(10)
+            board = run.start_board(t[0], t[1], m[0], m[1], exit[0], exit[1], vert, hor)
+            tier, winnable = run.prefilter(board, t, m, exit, rounds)
+            if tier is None:
+                continue
+            tiers.add(tier)
+            best = run.min_rounds(space, space.square(*t), space.square(*m))
+            assert winnable == (best is not None and best <= rounds), \
+                    "%s tier, seed %d, t %r, m %r, %d rounds" % (tier, seed, t, m, rounds)
+            assert winnable == run.EscapeSearch(space).winnable(space.square(*t),
+                                                                 space.square(*m), rounds)
+    assert tiers == set(run.PREFILTER_TIERS)
+
+def test_trace_summary_self_time():
+    # One state searched again inside its own subtree: its time must only count once
+    node = lambda id, parent, t, time, size: {'id': id, 'parent': parent, 'depth': 0, 't': t,
+                                              'm': [5, 5], 'move': None, 'won': False,
+                                              'time': time, 'size': size}
+    nodes = [node(2, 1, [0, 0], 0.5, 1), node(1, 0, [0, 1], 0.6, 2), node(0, None, [0, 0], 1.0, 3)]
+    own = trace_summary.self_times(nodes)
+    assert abs(own[0] - 0.4) < 1e-9 and abs(own[1] - 0.1) < 1e-9 and abs(own[2] - 0.5) < 1e-9
+    hot = [line for line in trace_summary.summarize(nodes, 1) if line.startswith('  0,0 ')]
+    assert hot and hot[0].split()[3] == '0.9000'
+
+def test_trace_self_times_add_up(tmp_path):
+    vert, hor, exit = random_maze(1)
+    hedges = run.Hedges()
+    hedges.vert, hedges.hor = vert, hor
+    run.reset_custom_constraints()
+    path = str(tmp_path / 'trace.jsonl')
+    with run.SearchTracer(path):
+        board = run.start_board(0, 0, 5, 5, exit[0], exit[1], vert, hor)
+        run.NUM_ROUNDS = 6
+        run.is_winnable(board, run.ThesPos(0, 0), run.MinoPos(5, 5), run.ExitSquare(*exit), hedges, 0)
+    nodes = trace_summary.load_trace(path)
+    root_time = sum(node['time'] for node in nodes if node['parent'] is None)
+    assert abs(sum(trace_summary.self_times(nodes).values()) - root_time) < 1e-5 * len(nodes)
+
+def test_solve_with_budget():
+    for seed in TEST_SEEDS:
+        space = maze_space(*random_maze(seed))
+        rng = random.Random(seed)
+        for i in range(10):
+            t, m = rng.randrange(space.num_squares), rng.randrange(space.num_squares)
+            best = run.min_rounds(space, t, m)
+            rounds = rng.randrange(12)
+            result = run.solve_with_budget(space, t, m, rounds)
+            if best is not None and best <= rounds:
+                assert (result.status, result.moves, result.horizon) == (run.WINNABLE, best, best - 1)
+            else:
+                assert (result.status, result.horizon) == (run.NOT_WINNABLE, rounds)
+            if best is not None and best >= 2:
+                # Budgets too small to finish stop early, having proven less than the answer
+                for budget in ({'node_limit': 1}, {'time_limit': 0}):
+                    result = run.solve_with_budget(space, t, m, best, **budget)
+                    assert result.status == run.UNKNOWN and result.horizon < best - 1
+
+def test_solve_with_budget_stops_on_time():
+    # Theseus can never escape, so every try fails after a few nodes; the budget still
+    # has to end the loop over round counts
+    space = maze_space(*random_maze(0))
+    t, m = next((t, m) for t in range(space.num_squares) for m in range(space.num_squares)
+                if t != m and run.min_rounds(space, t, m) is None)
+    result = run.solve_with_budget(space, t, m, 10 ** 7, time_limit=0.05)
+    assert result.status == run.UNKNOWN and result.elapsed < 1.0
+
+def test_parallel_winnable_matches_search():
+    cases = {'early win': 0, 'all lost': 0, 'workers won': 0, 'workers lost': 0}
+    for seed in TEST_SEEDS[:4]:
+        space = maze_space(*random_maze(seed))
+        rng = random.Random(seed)
+        for i in range(6):
+            t, m = rng.randrange(space.num_squares), rng.randrange(space.num_squares)
+            rounds = rng.randrange(1, 8)
+            expected = run.EscapeSearch(space).winnable(t, m, rounds)
+            best = run.min_rounds(space, t, m)
+            for split_depth in range(4):
+                assert run.parallel_winnable(space, t, m, rounds, workers=2,
+                                             split_depth=split_depth) == expected, \
+                        "seed %d, t %d, m %d, %d rounds, split depth %d" % (seed, t, m, rounds, split_depth)
+                if expected and best <= split_depth:
+                    # Found while splitting, before any worker starts
+                    cases['early win'] += 1
+                elif not expected and rounds <= split_depth:
+                    # Every branch runs out of rounds while splitting
+                    cases['all lost'] += 1
+                elif split_depth:
+                    cases['workers won' if expected else 'workers lost'] += 1
+    assert all(cases.values()), cases
+
+def test_synthesize_maze():
+    for t, m, exit, num_moves in [((0, 2), (5, 2), (3, 5), 6), ((5, 0), (0, 5), (2, 2), 5),
+                                  ((0, 0), (5, 5), (3, 3), 8)]:
+        vert, hor = run.synthesize_maze(t, m, exit, num_moves)
+        space = maze_space(vert, hor, exit)
+        assert run.min_rounds(space, space.square(*t), space.square(*m)) == num_moves
+    # Fewer rounds than the exit is steps away, and more rounds than there are states
+    assert run.synthesize_maze((0, 2), (5, 2), (3, 5), 4) is None
+    assert run.synthesize_maze((0, 2), (5, 2), (3, 5), (run.BOARD_SIZE ** 2) ** 2) is None
+
+def test_generate_mazes():
+    np = pytest.importorskip('numpy')
+    size = run.BOARD_SIZE
+    counts = np.arange(40) % (2 * size * (size - 1) + 1)
+    for num_hedges in (0, 17, counts):
+        vert, hor, thes, mino, exit = run.generate_mazes(40, num_hedges, seed=3)
+        expected = np.broadcast_to(num_hedges, (40,))
+        # Hedges only between two squares: never right of the last column or on
+        # top of the first row
+        assert not vert[:, :, size - 1].any() and not hor[:, 0, :].any()
+        assert (vert.sum(axis=(1, 2)) + hor.sum(axis=(1, 2)) == expected).all()
+        for squares in (thes, mino, exit):
+            assert squares.shape == (40, 2) and (squares >= 0).all() and (squares < size).all()
+        numbers = [squares[:, 0] * size + squares[:, 1] for squares in (thes, mino, exit)]
+        assert ((numbers[0] != numbers[1]) & (numbers[0] != numbers[2]) & (numbers[1] != numbers[2])).all()
+    with pytest.raises(ValueError):
+        run.generate_mazes(1, 2 * size * (size - 1) + 1)
+
+def test_threat_masks_match_move_checks():
+    size = run.BOARD_SIZE
+    for seed in range(20):
+        vert, hor, exit = random_maze(seed, density=[0.2, 0.4, 0.6][seed % 3])
+        board = run.start_board(-1, -1, -1, -1, exit[0], exit[1], vert, hor)
+        masks = run.MinoMoves.threat_masks(board)
+        for m_row in range(size):
+            for m_col in range(size):
+                for targ_row in range(size):
+                    for targ_col in range(size):
+                        threatened = (run.ThesMoves.mino_within_range(targ_row, targ_col, m_row, m_col)
+                                      and not run.MinoMoves.mino_hedges_in_way(board, targ_row, targ_col,
+                                                                               m_row, m_col))
+                        bit = masks[m_row * size + m_col] >> (targ_row * size + targ_col) & 1
+                        assert bool(bit) == bool(threatened), (seed, m_row, m_col, targ_row, targ_col)
+
+def test_backends_agree(tmp_path):
+    # One satisfiable and one unsatisfiable synthesis encoding, and a compiled theory
+    paths = []
+    for num_moves in (5, 4):
+        synthesis = run.MazeSynthesis((5, 0), (0, 5), (2, 2), num_moves)
+        synthesis.build()
+        paths.append(str(tmp_path / ('synthesis_%d.cnf' % num_moves)))
+        synthesis.write(paths[-1])
+    vert, hor, exit = random_maze(2)
+    hedges = run.Hedges()
+    hedges.vert, hedges.hor = vert, hor
+    run.reset_custom_constraints()
+    run.NUM_ROUNDS = 3
+    board = run.start_board(0, 0, 5, 5, exit[0], exit[1], vert, hor)
+    run.is_winnable(board, run.ThesPos(0, 0), run.MinoPos(5, 5), run.ExitSquare(*exit), hedges, 0)
+    paths.append(str(tmp_path / 'theory.cnf'))
+    run.export_dimacs(run.E.compile(), paths[-1])
+    run.reset_custom_constraints()
+
+    backends = [backend for backend in run.SAT_BACKENDS if run.backend_available(backend)]
+    answers = [[run.solve_cnf_file(path, backend).satisfiable for backend in backends] for path in paths]
+    assert answers[0] == [True] * len(backends) and answers[1] == [False] * len(backends)
+    assert len(set(answers[2])) == 1
+    # Synthesis variables stay out of the game's encoding
+    assert 'HedgeSegment' not in run.E.propositions
+
 def test_draft_files():
     file_checks('draft')
 
@@ -0,0 +1,99 @@
+
+import argparse, json, sys
+from collections import defaultdict
+
+USAGE = '\n\tpython3 trace_summary.py trace.jsonl [--top 10]\n'
+
+
+def load_trace(path):
+    '''
+    @param: path (str)  file written by run.SearchTracer
+    @return: list of node records (dicts)
+    '''
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def self_times(nodes):
+    '''
+    A node's time includes its whole subtree; this takes its children's time back
+    out, so adding up the result over several nodes never counts anything twice
+    (even when one visit of a state is inside another).
+    @param: nodes (list of dicts)  records from load_trace()
+    @return: {node id: seconds spent in the node itself}
+    '''
+    own = {node['id']: node['time'] for node in nodes}
+    for node in nodes:
+        if node['parent'] is not None and node['parent'] in own:
+            own[node['parent']] -= node['time']
+    return own
+
+def summarize(nodes, top):
+    '''
+    Summarizes a search trace: totals, the states expanded most often, how much
+    of the search went into revisiting states, and the largest subtrees.
+    @param: nodes (list of dicts)  records from load_trace()
+    @param: top (int)              how many states/subtrees to list
+    @return: list of report lines
+    '''
+    lines = []
+    if not nodes:
+        return ['Empty trace']
+    roots = [node for node in nodes if node['parent'] is None]
+    lines.append('Nodes expanded:   %d' % len(nodes))
+    lines.append('Searches:         %d (%d won)' % (len(roots), sum(1 for node in roots if node['won'])))
+    lines.append('Deepest round:    %d' % max(node['depth'] for node in nodes))
+    lines.append('Search time:      %.4fs' % sum(node['time'] for node in roots))
+    lines.append('')
+
+    # The same (Theseus, Minotaur) state can be reached by many move orders, and
+    # is_winnable() searches it again each time
+    visits = defaultdict(list)
+    for node in nodes:
+        visits[tuple(node['t']), tuple(node['m'])].append(node)
+    revisits = len(nodes) - len(visits)
+    lines.append('Distinct states:  %d' % len(visits))
+    lines.append('Revisits:         %d (%.1f%% of nodes)' % (revisits, 100.0 * revisits / len(nodes)))
+    per_depth = defaultdict(int)
+    seen = set()
+    for node in sorted(nodes, key=lambda node: node['id']):
+        state = tuple(node['t']), tuple(node['m'])
+        if state in seen:
+            per_depth[node['depth']] += 1
+        seen.add(state)
+    if per_depth:
+        lines.append('Revisits by round: ' + ', '.join('%d: %d' % (depth, per_depth[depth])
+                                                      for depth in sorted(per_depth)))
+    lines.append('')
+
+    # Time spent in the state's own nodes, not in the subtrees below them
+    own = self_times(nodes)
+    lines.append('Hot states (most expanded):')
+    lines.append('  %-8s %-8s %7s %10s %12s' % ('theseus', 'minotaur', 'visits', 'self s', 'mean subtree'))
+    hot = sorted(visits.items(), key=lambda item: (-len(item[1]), item[0]))[:top]
+    for (t, m), group in hot:
+        lines.append('  %-8s %-8s %7d %10.4f %12.1f'
+                     % ('%d,%d' % t, '%d,%d' % m, len(group), sum(own[node['id']] for node in group),
+                        sum(node['size'] for node in group) / float(len(group))))
+    lines.append('')
+
+    lines.append('Largest subtrees:')
+    lines.append('  %-6s %5s %-8s %-8s %-6s %5s %8s %10s' % ('id', 'round', 'theseus', 'minotaur',
+                                                          'move', 'won', 'nodes', 'time s'))
+    for node in sorted(nodes, key=lambda node: (-node['size'], node['id']))[:top]:
+        lines.append('  %-6d %5d %-8s %-8s %-6s %5s %8d %10.4f'
+                     % (node['id'], node['depth'], '%d,%d' % tuple(node['t']), '%d,%d' % tuple(node['m']),
+                        node['move'] or '-', node['won'], node['size'], node['time']))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage=USAGE)
+    parser.add_argument('trace', help='JSONL file written by run.SearchTracer')
+    parser.add_argument('--top', type=int, default=10, help='how many states and subtrees to list')
+    args = parser.parse_args()
+    try:
+        nodes = load_trace(args.trace)
+    except (OSError, ValueError) as e:
+        print("Couldn't read trace: %s" % e)
+        sys.exit(1)
+    print('\n'.join(summarize(nodes, args.top)))